@@ -2,42 +2,65 @@
 Configuration for the SSH Telegram Bot
 """
 import os
+from typing import FrozenSet, Final, Optional
 from decouple import config
 
+
+def _clamped(value: float, low: float, high: float) -> float:
+    """Keep a numeric setting inside a sane range"""
+    return max(low, min(high, value))
+
+
 # Bot Configuration
-TELEGRAM_TOKEN = config('TELEGRAM_TOKEN')
-WEBAPP_URL = config('WEBAPP_URL', default=None)
+TELEGRAM_TOKEN: Final[str] = config('TELEGRAM_TOKEN')
+WEBAPP_URL: Final[Optional[str]] = config('WEBAPP_URL', default=None)
+
+# Webhook Configuration (polling is used when WEBHOOK_URL is unset)
+WEBHOOK_URL: Final[Optional[str]] = config('WEBHOOK_URL', default=None)
+WEBHOOK_LISTEN: Final[str] = config('WEBHOOK_LISTEN', default='0.0.0.0')
+WEBHOOK_PORT: Final[int] = config('WEBHOOK_PORT', default=8443, cast=int)
+WEBHOOK_SECRET_TOKEN: Final[Optional[str]] = config('WEBHOOK_SECRET_TOKEN', default=None)
 
 # Database Configuration
-DATABASE_URL = config('DATABASE_URL', default='sqlite:///ssh_connections.db')
+DATABASE_URL: Final[str] = config('DATABASE_URL', default='sqlite:///ssh_connections.db')
 
 # Encryption Configuration
-ENCRYPTION_KEY = config('ENCRYPTION_KEY', default='change_this_to_a_secure_key!')
+ENCRYPTION_KEY: Final[str] = config('ENCRYPTION_KEY', default='change_this_to_a_secure_key!')
 
 # Session Configuration
-MAX_SESSIONS_PER_USER = config('MAX_SESSIONS_PER_USER', default=3, cast=int)
-SESSION_TIMEOUT_MINUTES = config('SESSION_TIMEOUT_MINUTES', default=30, cast=int)
-POLL_INTERVAL = config('POLL_INTERVAL', default=0.2, cast=float)
+MAX_SESSIONS_PER_USER: Final[int] = config('MAX_SESSIONS_PER_USER', default=3, cast=int)
+SESSION_TIMEOUT_MINUTES: Final[int] = config('SESSION_TIMEOUT_MINUTES', default=30, cast=int)
+POLL_INTERVAL: Final[float] = config('POLL_INTERVAL', default=0.2, cast=float)
+MESSAGE_DEBOUNCE_MS: Final[int] = config('MESSAGE_DEBOUNCE_MS', default=0, cast=int)  # 0 sends each message at once
+
+# Output streaming: minimum gap between message edits per chat, backed off
+# towards the maximum while Telegram answers with 429s
+EDIT_INTERVAL_MIN: Final[float] = _clamped(config('EDIT_INTERVAL_MIN', default=0.3, cast=float), 0.05, 5.0)
+EDIT_INTERVAL_MAX: Final[float] = _clamped(config('EDIT_INTERVAL_MAX', default=2.0, cast=float), EDIT_INTERVAL_MIN, 30.0)
 
 # SSH Defaults
-DEFAULT_SSH_PORT = config('DEFAULT_SSH_PORT', default=22, cast=int)
-DEFAULT_SSH_USER = config('DEFAULT_SSH_USER', default=os.environ.get("USER", "root"))
+DEFAULT_SSH_PORT: Final[int] = config('DEFAULT_SSH_PORT', default=22, cast=int)
+DEFAULT_SSH_USER: Final[str] = config('DEFAULT_SSH_USER', default=os.environ.get("USER", "root"))
+SSH_CONTROL_PERSIST: Final[int] = config('SSH_CONTROL_PERSIST', default=600, cast=int)  # Seconds, 0 disables pooling
 
 # Security Configuration
-ENABLE_AUDIT_LOG = config('ENABLE_AUDIT_LOG', default=True, cast=bool)
-RATE_LIMIT_COMMANDS = config('RATE_LIMIT_COMMANDS', default=10, cast=int)  # Per minute
-MAX_CONNECTION_ATTEMPTS = config('MAX_CONNECTION_ATTEMPTS', default=3, cast=int)
+ENABLE_AUDIT_LOG: Final[bool] = config('ENABLE_AUDIT_LOG', default=True, cast=bool)
+AUDIT_LOG_RETENTION_DAYS: Final[int] = config('AUDIT_LOG_RETENTION_DAYS', default=30, cast=int)
+RATE_LIMIT_COMMANDS: Final[int] = config('RATE_LIMIT_COMMANDS', default=10, cast=int)  # Per minute
+MAX_CONNECTION_ATTEMPTS: Final[int] = config('MAX_CONNECTION_ATTEMPTS', default=3, cast=int)
 
 # Telegram Limits
-TG_MESSAGE_LIMIT = 4096
+TG_MESSAGE_LIMIT: Final[int] = 4096
 
 # Feature Flags
-ALLOW_QUICK_CONNECT = config('ALLOW_QUICK_CONNECT', default=True, cast=bool)
-ALLOW_KEY_UPLOAD = config('ALLOW_KEY_UPLOAD', default=True, cast=bool)
-ALLOW_MULTIPLE_SESSIONS = config('ALLOW_MULTIPLE_SESSIONS', default=False, cast=bool)
+ALLOW_QUICK_CONNECT: Final[bool] = config('ALLOW_QUICK_CONNECT', default=True, cast=bool)
+ALLOW_KEY_UPLOAD: Final[bool] = config('ALLOW_KEY_UPLOAD', default=True, cast=bool)
+ALLOW_MULTIPLE_SESSIONS: Final[bool] = config('ALLOW_MULTIPLE_SESSIONS', default=False, cast=bool)
 
 # Admin Users (optional - for bot administration)
-ADMIN_USER_IDS = config('ADMIN_USER_IDS', default='', cast=lambda x: set(map(int, filter(None, x.split(',')))))
+ADMIN_USER_IDS: Final[FrozenSet[int]] = frozenset(
+    int(user_id) for user_id in config('ADMIN_USER_IDS', default='').split(',') if user_id.strip()
+)
 
 # Development
-DEBUG = config('DEBUG', default=False, cast=bool)
\ No newline at end of file
+DEBUG: Final[bool] = config('DEBUG', default=False, cast=bool)
@@ -1,7 +1,30 @@
 """
 Database module for SSH connection management
 """
-from .models import Base, User, SSHConnection, ActiveSession
-from .manager import DatabaseManager
+import importlib
 
-__all__ = ['Base', 'User', 'SSHConnection', 'ActiveSession', 'DatabaseManager']
\ No newline at end of file
+# Submodules are imported on first attribute access (PEP 562) so that
+# importing the package does not pull in SQLAlchemy's ORM up front
+_LAZY_ATTRS = {
+    'Base': '.models',
+    'User': '.models',
+    'SSHConnection': '.models',
+    'ActiveSession': '.models',
+    'DatabaseManager': '.manager',
+    'AsyncDatabaseManager': '.manager',
+}
+
+__all__ = ['Base', 'User', 'SSHConnection', 'ActiveSession', 'DatabaseManager', 'AsyncDatabaseManager']
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -2,81 +2,335 @@
 Database manager for handling all database operations
 """
 import os
-from datetime import datetime
-from typing import Optional, List
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+import asyncio
+import atexit
+import functools
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Optional, List, Tuple
+from sqlalchemy import create_engine, event, exists, bindparam, delete, func, insert, inspect, select
+from sqlalchemy.orm import sessionmaker, scoped_session, aliased, undefer_group, Session
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.exc import IntegrityError
 from .models import Base, User, SSHConnection, ActiveSession, AuditLog
 
+# Buffered User.last_seen updates are written at most this often (seconds)
+LAST_SEEN_FLUSH_INTERVAL = 60.0
+
+# Registered users kept in memory so ensure_registered skips the database
+USER_CACHE_SIZE = 10_000
+
+# Per-user connection list cache; the TTL bounds staleness when another
+# process (e.g. the webapp) shares the same database
+CONNECTION_CACHE_SIZE = 1000
+CONNECTION_CACHE_TTL = timedelta(seconds=60)
+
+# Buffered SSHConnection.last_used updates are written at most this often (seconds)
+LAST_USED_FLUSH_INTERVAL = 60.0
+
+# Buffered session activity is written at most this often (seconds)
+ACTIVITY_FLUSH_INTERVAL = 10.0
+
+# Audit entries are written in batches of up to this many rows...
+AUDIT_BATCH_SIZE = 100
+# ...or whatever has queued up within this many seconds
+AUDIT_FLUSH_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+# Default interval between background maintenance runs (seconds)
+MAINTENANCE_INTERVAL = 3600
+
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = (
+    "PRAGMA auto_vacuum=INCREMENTAL",  # Only takes effect on newly created databases
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA foreign_keys=ON",
+)
+
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    """Tune SQLite for concurrent readers and cheaper commits"""
+    cursor = dbapi_conn.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
 class DatabaseManager:
+    # Statements for the hottest lookups are built once; executing the same
+    # statement object lets SQLAlchemy reuse its compiled form
+    _STMT_GET_USER = select(User).where(User.user_id == bindparam('uid'))
+    _STMT_GET_CONNECTIONS = select(SSHConnection).where(
+        SSHConnection.user_id == bindparam('uid')
+    ).order_by(SSHConnection.id)
+    _STMT_COUNT_CONNECTIONS = select(func.count()).select_from(SSHConnection).where(
+        SSHConnection.user_id == bindparam('uid')
+    )
+    _STMT_GET_CONNECTION_BY_ID = select(SSHConnection).where(SSHConnection.id == bindparam('cid'))
+    _STMT_GET_ACTIVE_SESSION = select(ActiveSession).where(ActiveSession.user_id == bindparam('uid'))
+    _STMT_GET_SESSION_BY_ID = select(ActiveSession).where(ActiveSession.session_id == bindparam('sid'))
+    _STMT_TOUCH_SESSIONS = ActiveSession.__table__.update().where(
+        ActiveSession.__table__.c.session_id == bindparam('_session_id')
+    ).values(last_activity=bindparam('_last_activity'))
+    _STMT_TOUCH_USERS = User.__table__.update().where(
+        User.__table__.c.user_id == bindparam('_user_id')
+    ).values(last_seen=bindparam('_last_seen'))
+    _STMT_TOUCH_CONNECTIONS = SSHConnection.__table__.update().where(
+        SSHConnection.__table__.c.id == bindparam('_id')
+    ).values(last_used=bindparam('_last_used'))
+    
     def __init__(self, database_url: str = None):
         """Initialize database connection"""
         if database_url is None:
             database_url = os.environ.get('DATABASE_URL', 'sqlite:///ssh_connections.db')
         
-        self.engine = create_engine(database_url, echo=False)
+        connect_args = {}
+        if database_url.startswith('sqlite'):
+            # Pooled connections are shared between the bot's worker threads
+            connect_args['check_same_thread'] = False
+        
+        self.engine = create_engine(
+            database_url,
+            echo=False,
+            poolclass=QueuePool,
+            pool_size=10,
+            max_overflow=20,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+            connect_args=connect_args
+        )
+        if self.engine.url.get_backend_name() == 'sqlite':
+            event.listen(self.engine, "connect", _set_sqlite_pragmas)
         Base.metadata.create_all(self.engine)
-        self.SessionLocal = sessionmaker(bind=self.engine)
+        self.SessionLocal = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.Session = scoped_session(self.SessionLocal)
+        # Older schemas allowed several sessions per user; keep only the newest
+        # so the unique index below can be built
+        existing = {ix['name'] for ix in inspect(self.engine).get_indexes(ActiveSession.__tablename__)}
+        if 'uq_sess_user' not in existing:
+            self._dedupe_active_sessions()
+        # create_all() skips indexes on tables that already exist
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                try:
+                    index.create(self.engine, checkfirst=True)
+                except IntegrityError as e:
+                    # Rows written meanwhile by an older process; run without it
+                    logger.warning(f"Could not create index {index.name}: {e}")
+        
+        # Detached users already known to exist, keyed by Telegram user ID (LRU)
+        self._known_users: "OrderedDict[int, User]" = OrderedDict()
+        self._known_users_lock = threading.Lock()
+        
+        # user_id -> (loaded_at, detached SSHConnection rows), oldest first
+        self._conn_cache: "OrderedDict[int, tuple]" = OrderedDict()
+        self._conn_cache_lock = threading.RLock()
+        
+        # user_id -> last_seen not yet written to the database
+        self._last_seen_buf: Dict[int, datetime] = {}
+        self._last_seen_lock = threading.Lock()
+        self._last_seen_flushed_at = time.monotonic()
+        atexit.register(self.flush_user_last_seen)
+        
+        # connection_id -> last_used not yet written to the database
+        self._last_used_buf: Dict[int, datetime] = {}
+        self._last_used_lock = threading.Lock()
+        self._last_used_flushed_at = time.monotonic()
+        atexit.register(self.flush_last_used)
+        
+        # session_id -> latest activity not yet written to the database
+        self._activity_buf: Dict[str, datetime] = {}
+        self._activity_lock = threading.Lock()
+        self._activity_flushed_at = time.monotonic()
+        atexit.register(self.flush_session_activity)
+        # Flushed on a timer too, so a process that records activity rarely (the
+        # webapp, once per connect) doesn't leave it unwritten for other processes
+        threading.Thread(target=self._activity_worker, name="session-activity-flusher", daemon=True).start()
+        
+        self._maintenance_stop = threading.Event()
+        
+        # Audit entries are written off the request path by a daemon thread
+        self._audit_queue: "queue.Queue[Optional[dict]]" = queue.Queue()
+        self._audit_thread = threading.Thread(target=self._audit_worker, name="audit-log-writer", daemon=True)
+        self._audit_thread.start()
+        atexit.register(self.close_audit_log)
+    
+    # Getters return detached instances: sessions are closed before returning and
+    # expire_on_commit=False keeps column attributes loaded, so callers can read
+    # them freely (use to_dict() for plain snapshots). Relationships are not loaded.
     
     def get_session(self) -> Session:
-        """Get a new database session"""
-        return self.SessionLocal()
+        """Get the database session for the current scope"""
+        return self.Session()
+    
+    def remove_session(self):
+        """Release the scoped session (call at the end of each update)"""
+        self.Session.remove()
+    
+    @contextmanager
+    def session_scope(self):
+        """Provide a transactional scope around a series of operations"""
+        session = self.get_session()
+        try:
+            yield session
+            session.commit()
+        except:
+            session.rollback()
+            raise
+        finally:
+            session.close()
     
     # User Management
     def get_or_create_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None) -> User:
         """Get existing user or create new one"""
-        session = self.get_session()
-        try:
+        now = datetime.utcnow()
+        user = self._cached_user(user_id)
+        
+        if user is not None:
+            changed = self._changed_user_fields(user, username, first_name, last_name)
+            if not changed:
+                # Known user: only last_seen moves, and that write is batched
+                user.last_seen = now
+                self._touch_user(user_id, now)
+                return user
+            
+            # Known user with a new name: refresh it and last_seen in one UPDATE
+            with self.session_scope() as session:
+                updated = session.query(User).filter_by(user_id=user_id).update(
+                    {User.last_seen: now, **{getattr(User, k): v for k, v in changed.items()}},
+                    synchronize_session=False
+                )
+            if updated:
+                for key, value in changed.items():
+                    setattr(user, key, value)
+                user.last_seen = now
+                return user
+            with self._known_users_lock:
+                self._known_users.pop(user_id, None)
+        
+        registered = False
+        with self.session_scope() as session:
             user = session.query(User).filter_by(user_id=user_id).first()
             if not user:
                 user = User(
                     user_id=user_id,
                     username=username,
                     first_name=first_name,
-                    last_name=last_name
+                    last_name=last_name,
+                    last_seen=now
                 )
                 session.add(user)
-                session.commit()
-                self.add_audit_log(user_id, "user_registered", f"New user registered: {username}")
+                registered = True
             else:
                 # Update last seen
-                user.last_seen = datetime.utcnow()
-                if username and user.username != username:
-                    user.username = username
-                if first_name and user.first_name != first_name:
-                    user.first_name = first_name
-                if last_name and user.last_name != last_name:
-                    user.last_name = last_name
-                session.commit()
-            
+                user.last_seen = now
+                for key, value in self._changed_user_fields(user, username, first_name, last_name).items():
+                    setattr(user, key, value)
+        
+        if registered:
+            self.add_audit_log(user_id, "user_registered", f"New user registered: {username}")
+        self._remember_user(user)
+        return user
+    
+    def _touch_user(self, user_id: int, seen_at: datetime):
+        """Buffer a last_seen update, flushing when the interval has passed"""
+        if self._buffer_last_seen(user_id, seen_at):
+            self.flush_user_last_seen()
+    
+    def _buffer_last_seen(self, user_id: int, seen_at: datetime) -> bool:
+        """Buffer a last_seen update; True when a flush is due"""
+        with self._last_seen_lock:
+            self._last_seen_buf[user_id] = seen_at
+            return time.monotonic() - self._last_seen_flushed_at >= LAST_SEEN_FLUSH_INTERVAL
+    
+    def _see_known_user(self, user_id: int, username: str = None, first_name: str = None,
+                        last_name: str = None) -> Tuple[Optional[User], bool]:
+        """In-memory part of get_or_create_user.
+        
+        Returns (user, flush_due) for a cached user whose profile is unchanged,
+        or (None, False) when the database has to be consulted.
+        """
+        user = self._cached_user(user_id)
+        if user is None or self._changed_user_fields(user, username, first_name, last_name):
+            return None, False
+        now = datetime.utcnow()
+        user.last_seen = now
+        return user, self._buffer_last_seen(user_id, now)
+    
+    def flush_user_last_seen(self):
+        """Write buffered last_seen timestamps to the database"""
+        with self._last_seen_lock:
+            pending, self._last_seen_buf = self._last_seen_buf, {}
+            self._last_seen_flushed_at = time.monotonic()
+        if not pending:
+            return
+        
+        with self.session_scope() as session:
+            session.execute(self._STMT_TOUCH_USERS, [
+                {'_user_id': user_id, '_last_seen': last_seen}
+                for user_id, last_seen in pending.items()
+            ])
+    
+    def _cached_user(self, user_id: int) -> Optional[User]:
+        """Look up a known user and mark it recently used"""
+        with self._known_users_lock:
+            user = self._known_users.get(user_id)
+            if user is not None:
+                self._known_users.move_to_end(user_id)
             return user
-        finally:
-            session.close()
+    
+    def _remember_user(self, user: User):
+        """Cache a detached user, evicting the least recently used past USER_CACHE_SIZE"""
+        with self._known_users_lock:
+            self._known_users[user.user_id] = user
+            self._known_users.move_to_end(user.user_id)
+            while len(self._known_users) > USER_CACHE_SIZE:
+                self._known_users.popitem(last=False)
+    
+    @staticmethod
+    def _changed_user_fields(user: User, username: str, first_name: str, last_name: str) -> dict:
+        """Return the profile fields that differ from the stored user"""
+        changed = {}
+        if username and user.username != username:
+            changed['username'] = username
+        if first_name and user.first_name != first_name:
+            changed['first_name'] = first_name
+        if last_name and user.last_name != last_name:
+            changed['last_name'] = last_name
+        return changed
     
     def get_user(self, user_id: int) -> Optional[User]:
         """Get user by ID"""
+        user = self._cached_user(user_id)
+        if user is not None:
+            return user
+        
         session = self.get_session()
         try:
-            return session.query(User).filter_by(user_id=user_id).first()
+            user = session.execute(self._STMT_GET_USER, {'uid': user_id}).scalar_one_or_none()
         finally:
             session.close()
+        if user is not None:
+            self._remember_user(user)
+        return user
     
     # Connection Management
     def add_connection(self, user_id: int, name: str, host: str, port: int, username: str, 
                       auth_type: str, encrypted_password: str = None, 
                       encrypted_private_key: str = None, key_passphrase: str = None) -> SSHConnection:
         """Add new SSH connection"""
-        session = self.get_session()
-        try:
-            # Check if connection name already exists for user
-            existing = session.query(SSHConnection).filter_by(
-                user_id=user_id, name=name
-            ).first()
-            
-            if existing:
-                raise ValueError(f"Connection '{name}' already exists")
-            
+        with self.session_scope() as session:
             connection = SSHConnection(
                 user_id=user_id,
                 name=name,
@@ -90,125 +344,241 @@ class DatabaseManager:
             )
             
             # If this is the first connection, make it default
-            user_connections = session.query(SSHConnection).filter_by(user_id=user_id).count()
-            if user_connections == 0:
+            has_connections = session.query(
+                session.query(SSHConnection).filter_by(user_id=user_id).exists()
+            ).scalar()
+            if not has_connections:
                 connection.is_default = True
             
             session.add(connection)
-            session.commit()
-            
-            self.add_audit_log(user_id, "connection_added", f"Added connection: {name} ({host})")
-            return connection
+            try:
+                # The unique (user_id, name) index rejects duplicate names
+                session.flush()
+            except IntegrityError:
+                session.rollback()
+                raise ValueError(f"Connection '{name}' already exists")
+        
+        self._invalidate_connections(user_id)
+        self.add_audit_log(user_id, "connection_added", f"Added connection: {name} ({host})")
+        return connection
+    
+    def get_connections(self, user_id: int) -> List[SSHConnection]:
+        """Get all connections for a user (credential columns are not loaded)"""
+        cached = self._cached_connections(user_id)
+        if cached is not None:
+            return cached
+        
+        now = datetime.utcnow()
+        session = self.get_session()
+        try:
+            connections = session.execute(self._STMT_GET_CONNECTIONS, {'uid': user_id}).scalars().all()
         finally:
             session.close()
+        
+        with self._conn_cache_lock:
+            self._conn_cache[user_id] = (now, connections)
+            self._conn_cache.move_to_end(user_id)
+            while len(self._conn_cache) > CONNECTION_CACHE_SIZE:
+                self._conn_cache.popitem(last=False)
+        return list(connections)
     
-    def get_connections(self, user_id: int) -> List[SSHConnection]:
-        """Get all connections for a user"""
+    def _cached_connections(self, user_id: int) -> Optional[List[SSHConnection]]:
+        """A user's connections if the cache holds a fresh copy, else None"""
+        with self._conn_cache_lock:
+            cached = self._conn_cache.get(user_id)
+            if cached and datetime.utcnow() - cached[0] < CONNECTION_CACHE_TTL:
+                self._conn_cache.move_to_end(user_id)
+                return list(cached[1])
+        return None
+    
+    def count_connections(self, user_id: int) -> int:
+        """Count a user's connections without loading them"""
+        cached = self._cached_connections(user_id)
+        if cached is not None:
+            return len(cached)
+        
         session = self.get_session()
         try:
-            return session.query(SSHConnection).filter_by(user_id=user_id).all()
+            return session.execute(self._STMT_COUNT_CONNECTIONS, {'uid': user_id}).scalar_one()
         finally:
             session.close()
     
     def get_connection(self, user_id: int, connection_name: str) -> Optional[SSHConnection]:
         """Get specific connection by name"""
+        for connection in self.get_connections(user_id):
+            if connection.name == connection_name:
+                return connection
+        return None
+    
+    def get_connection_with_credentials(self, user_id: int, connection_name: str) -> Optional[SSHConnection]:
+        """Get a connection by name with its encrypted credential columns loaded"""
         session = self.get_session()
         try:
-            return session.query(SSHConnection).filter_by(
-                user_id=user_id, name=connection_name
-            ).first()
+            return session.query(SSHConnection).options(
+                undefer_group('credentials')
+            ).filter_by(user_id=user_id, name=connection_name).first()
         finally:
             session.close()
     
     def get_connection_by_id(self, user_id: int = None, connection_id: int = None) -> Optional[SSHConnection]:
         """Get specific connection by ID"""
-        session = self.get_session()
-        try:
-            if user_id and connection_id:
-                return session.query(SSHConnection).filter_by(
-                    user_id=user_id, id=connection_id
-                ).first()
-            elif connection_id:
-                return session.query(SSHConnection).filter_by(id=connection_id).first()
+        if user_id and connection_id:
+            for connection in self.get_connections(user_id):
+                if connection.id == connection_id:
+                    return connection
             return None
-        finally:
-            session.close()
-    
-    def update_connection_last_used(self, connection_id: int):
-        """Update last used timestamp for a connection"""
+        
+        if not connection_id:
+            return None
+        cached = self._find_cached_connection(connection_id)
+        if cached is not None:
+            return cached
+        
         session = self.get_session()
         try:
-            connection = session.query(SSHConnection).filter_by(id=connection_id).first()
-            if connection:
-                connection.last_used = datetime.utcnow()
-                session.commit()
+            return session.execute(self._STMT_GET_CONNECTION_BY_ID, {'cid': connection_id}).scalar_one_or_none()
         finally:
             session.close()
     
+    def _invalidate_connections(self, user_id: int):
+        """Drop the cached connection list for a user"""
+        with self._conn_cache_lock:
+            self._conn_cache.pop(user_id, None)
+    
+    def _find_cached_connection(self, connection_id: int) -> Optional[SSHConnection]:
+        """Find a cached connection by ID without touching the database"""
+        now = datetime.utcnow()
+        with self._conn_cache_lock:
+            for loaded_at, connections in self._conn_cache.values():
+                if now - loaded_at >= CONNECTION_CACHE_TTL:
+                    continue
+                for connection in connections:
+                    if connection.id == connection_id:
+                        return connection
+        return None
+    
+    def touch_last_used(self, connection_id: int):
+        """Buffer a last used timestamp for a connection, flushing when the interval has passed"""
+        now = datetime.utcnow()
+        cached = self._find_cached_connection(connection_id)
+        if cached:
+            cached.last_used = now
+        
+        with self._last_used_lock:
+            self._last_used_buf[connection_id] = now
+            due = time.monotonic() - self._last_used_flushed_at >= LAST_USED_FLUSH_INTERVAL
+        if due:
+            self.flush_last_used()
+    
+    def flush_last_used(self):
+        """Write buffered last_used timestamps to the database in one batch"""
+        pending = self._take_last_used()
+        if not pending:
+            return
+        
+        with self.session_scope() as session:
+            self._write_last_used(session, pending)
+    
+    def _take_last_used(self) -> Dict[int, datetime]:
+        """Swap out the buffered last_used timestamps"""
+        with self._last_used_lock:
+            pending, self._last_used_buf = self._last_used_buf, {}
+            self._last_used_flushed_at = time.monotonic()
+        return pending
+    
+    def _write_last_used(self, session: Session, pending: Dict[int, datetime]):
+        session.execute(self._STMT_TOUCH_CONNECTIONS, [
+            {'_id': connection_id, '_last_used': last_used}
+            for connection_id, last_used in pending.items()
+        ])
+    
     def delete_connection(self, user_id: int, connection_name: str) -> bool:
         """Delete a connection"""
-        session = self.get_session()
-        try:
+        with self.session_scope() as session:
             connection = session.query(SSHConnection).filter_by(
                 user_id=user_id, name=connection_name
             ).first()
             
-            if connection:
-                session.delete(connection)
-                session.commit()
-                self.add_audit_log(user_id, "connection_deleted", f"Deleted connection: {connection_name}")
-                return True
-            return False
-        finally:
-            session.close()
+            if not connection:
+                return False
+            session.delete(connection)
+        
+        self._invalidate_connections(user_id)
+        self.add_audit_log(user_id, "connection_deleted", f"Deleted connection: {connection_name}")
+        return True
     
     def set_default_connection(self, user_id: int, connection_name: str) -> bool:
         """Set a connection as default"""
-        session = self.get_session()
-        try:
-            # Remove default from all connections
-            session.query(SSHConnection).filter_by(user_id=user_id).update(
-                {'is_default': False}
+        target = aliased(SSHConnection)
+        target_exists = exists().where(target.user_id == user_id, target.name == connection_name)
+        
+        with self.session_scope() as session:
+            # Flag the named connection and clear the rest in one UPDATE;
+            # nothing changes when the name does not exist
+            updated = session.query(SSHConnection).filter(
+                SSHConnection.user_id == user_id, target_exists
+            ).update(
+                {SSHConnection.is_default: SSHConnection.name == connection_name},
+                synchronize_session=False
             )
-            
-            # Set new default
-            connection = session.query(SSHConnection).filter_by(
-                user_id=user_id, name=connection_name
-            ).first()
-            
-            if connection:
-                connection.is_default = True
-                session.commit()
-                return True
+        
+        if not updated:
             return False
-        finally:
-            session.close()
+        self._invalidate_connections(user_id)
+        return True
     
     # Session Management
     def create_session(self, user_id: int, session_id: str, connection_id: int = None, chat_id: int = None) -> ActiveSession:
         """Create new active session"""
-        session = self.get_session()
-        try:
+        with self.session_scope() as session:
+            return self._insert_session(session, user_id, session_id, connection_id, chat_id)
+    
+    def finalize_connect(self, connection_id: int, user_id: int, session_id: str,
+                         chat_id: int = None) -> ActiveSession:
+        """Record a successful connect (last_used and the new active session) in one transaction"""
+        now = datetime.utcnow()
+        cached = self._find_cached_connection(connection_id)
+        if cached:
+            cached.last_used = now
+        with self._last_used_lock:
+            self._last_used_buf[connection_id] = now
+        # Any other buffered last_used updates ride along on the same commit
+        pending = self._take_last_used()
+        
+        with self.session_scope() as session:
+            self._write_last_used(session, pending)
+            return self._insert_session(session, user_id, session_id, connection_id, chat_id)
+    
+    def _insert_session(self, session: Session, user_id: int, session_id: str,
+                        connection_id: int = None, chat_id: int = None) -> ActiveSession:
+        """Insert an active session row, replacing the user's previous one"""
+        now = datetime.utcnow()
+        values = {
+            'session_id': session_id,
+            'user_id': user_id,
+            'connection_id': connection_id,
+            'chat_id': chat_id,
+            'started_at': now,
+            'last_activity': now,
+            'terminal_width': 80,
+            'terminal_height': 24,
+            'is_webapp_connected': False,
+        }
+        if self.engine.url.get_backend_name() == 'sqlite':
+            # The unique user_id index makes REPLACE drop the user's previous session
+            session.execute(insert(ActiveSession).prefix_with('OR REPLACE').values(**values))
+        else:
             # Remove any existing sessions for this user
             session.query(ActiveSession).filter_by(user_id=user_id).delete()
-            
-            active_session = ActiveSession(
-                session_id=session_id,
-                user_id=user_id,
-                connection_id=connection_id,
-                chat_id=chat_id
-            )
-            session.add(active_session)
-            session.commit()
-            return active_session
-        finally:
-            session.close()
+            session.execute(insert(ActiveSession).values(**values))
+        
+        return ActiveSession(**values)
     
     def get_active_session(self, user_id: int) -> Optional[ActiveSession]:
         """Get active session for user"""
         session = self.get_session()
         try:
-            return session.query(ActiveSession).filter_by(user_id=user_id).first()
+            return session.execute(self._STMT_GET_ACTIVE_SESSION, {'uid': user_id}).scalars().first()
         finally:
             session.close()
     
@@ -216,62 +586,244 @@ class DatabaseManager:
         """Get session by session ID"""
         session = self.get_session()
         try:
-            return session.query(ActiveSession).filter_by(session_id=session_id).first()
+            return session.execute(self._STMT_GET_SESSION_BY_ID, {'sid': session_id}).scalar_one_or_none()
         finally:
             session.close()
     
     def update_session_activity(self, session_id: str):
-        """Update session last activity"""
-        session = self.get_session()
-        try:
-            active_session = session.query(ActiveSession).filter_by(session_id=session_id).first()
-            if active_session:
-                active_session.last_activity = datetime.utcnow()
-                session.commit()
-        finally:
-            session.close()
+        """Record session activity; writes are coalesced and flushed periodically"""
+        with self._activity_lock:
+            self._activity_buf[session_id] = datetime.utcnow()
+            due = time.monotonic() - self._activity_flushed_at >= ACTIVITY_FLUSH_INTERVAL
+        if due:
+            self.flush_session_activity()
+    
+    def flush_session_activity(self):
+        """Write buffered session activity timestamps to the database"""
+        with self._activity_lock:
+            pending, self._activity_buf = self._activity_buf, {}
+            self._activity_flushed_at = time.monotonic()
+        if not pending:
+            return
+        
+        # Core executemany: sessions deleted in the meantime are simply skipped
+        with self.session_scope() as session:
+            session.execute(self._STMT_TOUCH_SESSIONS, [
+                {'_session_id': session_id, '_last_activity': last_activity}
+                for session_id, last_activity in pending.items()
+            ])
+    
+    def _activity_worker(self):
+        """Flush buffered session activity every ACTIVITY_FLUSH_INTERVAL seconds"""
+        while True:
+            time.sleep(ACTIVITY_FLUSH_INTERVAL)
+            if not self._activity_buf:
+                continue
+            try:
+                self.flush_session_activity()
+            except Exception as e:
+                logger.warning(f"Failed to flush session activity: {e}")
+    
+    def _dedupe_active_sessions(self):
+        """Delete all but the most recently active session of each user"""
+        with self.session_scope() as session:
+            rows = session.execute(
+                select(ActiveSession.session_id, ActiveSession.user_id).order_by(
+                    ActiveSession.user_id,
+                    ActiveSession.last_activity.desc().nullslast(),
+                    ActiveSession.started_at.desc().nullslast(),
+                )
+            ).all()
+            seen = set()
+            stale = []
+            for session_id, user_id in rows:
+                if user_id in seen:
+                    stale.append(session_id)
+                else:
+                    seen.add(user_id)
+            if stale:
+                session.execute(delete(ActiveSession).where(ActiveSession.session_id.in_(stale)))
+                logger.info(f"Removed {len(stale)} duplicate active sessions")
     
     def delete_session(self, user_id: int):
         """Delete active session"""
-        session = self.get_session()
-        try:
+        with self.session_scope() as session:
             session.query(ActiveSession).filter_by(user_id=user_id).delete()
-            session.commit()
-        finally:
-            session.close()
     
     # Audit Logging
     def add_audit_log(self, user_id: int, action: str, details: str = None):
-        """Add audit log entry"""
-        session = self.get_session()
-        try:
-            log = AuditLog(
-                user_id=user_id,
-                action=action,
-                details=details
-            )
-            session.add(log)
-            session.commit()
-        except:
-            pass  # Don't fail on audit log errors
-        finally:
-            session.close()
+        """Queue an audit log entry for the background writer"""
+        self._audit_queue.put_nowait({
+            'user_id': user_id,
+            'action': action,
+            'details': details,
+            'timestamp': datetime.utcnow()
+        })
+    
+    def close_audit_log(self, timeout: float = 5.0):
+        """Write any queued audit entries and stop the background writer"""
+        self._audit_queue.put(None)
+        self._audit_thread.join(timeout)
+    
+    def _audit_worker(self):
+        """Drain the audit queue, writing up to AUDIT_BATCH_SIZE rows per commit"""
+        while True:
+            item = self._audit_queue.get()
+            if item is None:
+                return
+            
+            rows = [item]
+            deadline = time.monotonic() + AUDIT_FLUSH_INTERVAL
+            stop = False
+            while len(rows) < AUDIT_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._audit_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                rows.append(item)
+            
+            session = self.SessionLocal()
+            try:
+                session.bulk_insert_mappings(AuditLog, rows)
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.warning(f"Dropped {len(rows)} audit log entries: {e}")  # Don't fail on audit log errors
+            finally:
+                session.close()
+            
+            if stop:
+                return
+    
+    def prune_audit_log(self, days: int = 30) -> int:
+        """Delete audit log entries older than the given number of days"""
+        cutoff_time = datetime.utcnow() - timedelta(days=days)
+        with self.session_scope() as session:
+            deleted = session.query(AuditLog).filter(
+                AuditLog.timestamp < cutoff_time
+            ).delete(synchronize_session=False)
+        
+        if deleted and self.engine.url.get_backend_name() == 'sqlite':
+            # Return freed pages to the OS and refresh planner statistics
+            with self.engine.connect() as conn:
+                conn.exec_driver_sql("PRAGMA incremental_vacuum")
+                conn.exec_driver_sql("PRAGMA optimize")
+        return deleted
+    
+    def start_maintenance(self, audit_retention_days: int = 30, interval: float = MAINTENANCE_INTERVAL):
+        """Periodically prune the audit log (and write buffered timestamps) in a daemon thread.
+        
+        Sessions are not reaped here: the bot doesn't record activity for its own
+        SSH sessions, so a long one would lose its row while still open
+        """
+        def run():
+            while not self._maintenance_stop.wait(interval):
+                try:
+                    self.flush_user_last_seen()
+                    self.flush_last_used()
+                    self.prune_audit_log(audit_retention_days)
+                except Exception as e:
+                    logger.warning(f"Database maintenance failed: {e}")
+        
+        threading.Thread(target=run, name="db-maintenance", daemon=True).start()
+    
+    def stop_maintenance(self):
+        """Stop the background maintenance thread"""
+        self._maintenance_stop.set()
     
     def cleanup_old_sessions(self, timeout_minutes: int = 30):
         """Clean up old inactive sessions"""
-        session = self.get_session()
-        try:
-            from datetime import timedelta
+        # Sessions active since the last flush must not be reaped
+        self.flush_session_activity()
+        
+        with self.session_scope() as session:
             cutoff_time = datetime.utcnow() - timedelta(minutes=timeout_minutes)
             
-            old_sessions = session.query(ActiveSession).filter(
+            return session.query(ActiveSession).filter(
                 ActiveSession.last_activity < cutoff_time
-            ).all()
-            
-            for old_session in old_sessions:
-                session.delete(old_session)
-            
-            session.commit()
-            return len(old_sessions)
-        finally:
-            session.close()
\ No newline at end of file
+            ).delete(synchronize_session=False)
+
+
+class AsyncDatabaseManager:
+    """Awaitable facade over DatabaseManager.
+    
+    Each method call runs in a small dedicated thread pool so queries, commits
+    and fsyncs don't block the event loop, while DB concurrency stays bounded.
+    The hot handler lookups answer from the in-memory caches directly and only
+    hop to the pool on a miss. Attributes that aren't methods pass through.
+    """
+    
+    def __init__(self, db: DatabaseManager, max_workers: int = 8):
+        self.db = db
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+    
+    async def run(self, func, *args, **kwargs):
+        """Run any blocking callable that touches the database in the DB pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+    
+    async def get_or_create_user(self, user_id: int, username: str = None, first_name: str = None,
+                                 last_name: str = None) -> User:
+        """Get or create a user; known, unchanged users skip the pool"""
+        user, flush_due = self.db._see_known_user(user_id, username, first_name, last_name)
+        if user is None:
+            return await self.run(self.db.get_or_create_user, user_id, username, first_name, last_name)
+        if flush_due:
+            await self.run(self.db.flush_user_last_seen)
+        return user
+    
+    async def get_user(self, user_id: int) -> Optional[User]:
+        """Get user by ID, from the cache when possible"""
+        user = self.db._cached_user(user_id)
+        if user is None:
+            user = await self.run(self.db.get_user, user_id)
+        return user
+    
+    async def get_connections(self, user_id: int) -> List[SSHConnection]:
+        """Get all connections for a user, from the cache when possible"""
+        connections = self.db._cached_connections(user_id)
+        if connections is None:
+            connections = await self.run(self.db.get_connections, user_id)
+        return connections
+    
+    async def count_connections(self, user_id: int) -> int:
+        """Count a user's connections, from the cache when possible"""
+        connections = self.db._cached_connections(user_id)
+        if connections is None:
+            return await self.run(self.db.count_connections, user_id)
+        return len(connections)
+    
+    async def get_connection(self, user_id: int, connection_name: str) -> Optional[SSHConnection]:
+        """Get specific connection by name"""
+        for connection in await self.get_connections(user_id):
+            if connection.name == connection_name:
+                return connection
+        return None
+    
+    async def get_connection_by_id(self, user_id: int = None, connection_id: int = None) -> Optional[SSHConnection]:
+        """Get specific connection by ID"""
+        if not (user_id and connection_id):
+            return await self.run(self.db.get_connection_by_id, user_id, connection_id)
+        for connection in await self.get_connections(user_id):
+            if connection.id == connection_id:
+                return connection
+        return None
+    
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+        
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+        
+        # Cache the wrapper so later lookups skip __getattr__
+        setattr(self, name, call)
+        return call
@@ -2,9 +2,8 @@
 Database models for SSH connection management
 """
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey, Text
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Index
+from sqlalchemy.orm import declarative_base, relationship, deferred
 
 Base = declarative_base()
 
@@ -25,10 +24,26 @@ class User(Base):
     
     def __repr__(self):
         return f"<User(user_id={self.user_id}, username={self.username})>"
+    
+    def to_dict(self):
+        """Convert to dictionary for display"""
+        return {
+            'user_id': self.user_id,
+            'username': self.username,
+            'first_name': self.first_name,
+            'last_name': self.last_name,
+            'registered_at': self.registered_at.isoformat() if self.registered_at else None,
+            'is_active': self.is_active,
+            'last_seen': self.last_seen.isoformat() if self.last_seen else None
+        }
 
 
 class SSHConnection(Base):
     __tablename__ = 'ssh_connections'
+    __table_args__ = (
+        Index('ix_ssh_user_name', 'user_id', 'name', unique=True),
+        Index('ix_ssh_user_default', 'user_id', 'is_default'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.user_id'), nullable=False)
@@ -37,9 +52,10 @@ class SSHConnection(Base):
     port = Column(Integer, default=22)
     username = Column(String(100), nullable=False)
     auth_type = Column(String(20), nullable=False)  # 'password' or 'key'
-    encrypted_password = Column(Text, nullable=True)  # Encrypted password
-    encrypted_private_key = Column(Text, nullable=True)  # Encrypted SSH private key
-    key_passphrase = Column(Text, nullable=True)  # Encrypted key passphrase
+    # Credential blobs are only loaded when a connection is actually opened
+    encrypted_password = deferred(Column(Text, nullable=True), group='credentials')  # Encrypted password
+    encrypted_private_key = deferred(Column(Text, nullable=True), group='credentials')  # Encrypted SSH private key
+    key_passphrase = deferred(Column(Text, nullable=True), group='credentials')  # Encrypted key passphrase
     created_at = Column(DateTime, default=datetime.utcnow)
     last_used = Column(DateTime, nullable=True)
     is_default = Column(Boolean, default=False)
@@ -66,6 +82,11 @@ class SSHConnection(Base):
 
 class ActiveSession(Base):
     __tablename__ = 'active_sessions'
+    __table_args__ = (
+        # One active session per user; lets SQLite replace it with INSERT OR REPLACE
+        Index('uq_sess_user', 'user_id', unique=True),
+        Index('ix_sess_last_activity', 'last_activity'),
+    )
     
     session_id = Column(String(100), primary_key=True)
     user_id = Column(Integer, ForeignKey('users.user_id'), nullable=False)
@@ -102,6 +123,10 @@ class ActiveSession(Base):
 
 class AuditLog(Base):
     __tablename__ = 'audit_log'
+    __table_args__ = (
+        Index('ix_audit_user_ts', 'user_id', 'timestamp'),
+        Index('ix_audit_ts', 'timestamp'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.user_id'), nullable=False)
@@ -111,4 +136,15 @@ class AuditLog(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
     
     def __repr__(self):
-        return f"<AuditLog(user_id={self.user_id}, action={self.action}, timestamp={self.timestamp})>"
\ No newline at end of file
+        return f"<AuditLog(user_id={self.user_id}, action={self.action}, timestamp={self.timestamp})>"
+    
+    def to_dict(self):
+        """Convert to dictionary for API responses"""
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'action': self.action,
+            'details': self.details,
+            'ip_address': self.ip_address,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None
+        }
\ No newline at end of file
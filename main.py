@@ -17,30 +17,35 @@ Run with: python main_v2.py
 """
 
 import asyncio
+import codecs
 import os
 import logging
 import textwrap
-import io
 import re
-from typing import Optional
-from datetime import datetime, timedelta
+from collections import deque
+from typing import Dict, Final, List, Optional, Tuple
+
+import pexpect
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application, 
     CommandHandler, 
     MessageHandler, 
     CallbackQueryHandler,
+    TypeHandler,
     ContextTypes, 
     filters
 )
 
 # Import our modules
 import config
-from database import DatabaseManager
+from database import DatabaseManager, AsyncDatabaseManager
 from security import EncryptionManager
-from ssh import EnhancedSSHManager, ConnectionManager
+from ssh import EnhancedSSHManager, ConnectionManager, SSHSessionPool
 from ui import KeyboardBuilder, ConnectionWizard
 
 # Import existing modules (TUI support)
@@ -51,6 +56,20 @@ except ImportError:
     HAS_PYTE = False
     print("pyte not installed - TUI mode disabled")
 
+# Faster event loop when available
+try:
+    import uvloop
+    HAS_UVLOOP = True
+except ImportError:
+    HAS_UVLOOP = False
+
+# HTTP/2 for Bot API calls needs the h2 package (httpx[http2])
+try:
+    import h2
+    BOT_API_HTTP_VERSION = "2"
+except ImportError:
+    BOT_API_HTTP_VERSION = "1.1"
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO if not config.DEBUG else logging.DEBUG,
@@ -60,8 +79,10 @@ logger = logging.getLogger(__name__)
 
 # Initialize components
 db = DatabaseManager(config.DATABASE_URL)
+adb = AsyncDatabaseManager(db)  # For DB calls that shouldn't block the event loop
 encryption = EncryptionManager(config.ENCRYPTION_KEY)
-ssh_manager = EnhancedSSHManager(db, encryption)
+ssh_pool = SSHSessionPool(config.SSH_CONTROL_PERSIST) if config.SSH_CONTROL_PERSIST > 0 else None
+ssh_manager = EnhancedSSHManager(db, encryption, ssh_pool)
 connection_mgr = ConnectionManager(db, encryption)
 keyboard_builder = KeyboardBuilder()
 
@@ -76,12 +97,156 @@ def format_connection_info(conn: dict) -> str:
         info += f"Last used: {conn['last_used']}"
     return info
 
-def escape_markdown(text: str) -> str:
-    """Escape special characters for Markdown V2"""
-    chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-    for char in chars:
-        text = text.replace(char, f'\\{char}')
-    return text
+def _rest(text: str) -> str:
+    """Return the argument text after a /command (empty if there is none)"""
+    i = text.find(' ')
+    return text[i + 1:].strip() if i > 0 else ''
+
+class _PlainTextFilter(filters.MessageFilter):
+    """Text that isn't a /command - one check instead of TEXT & ~COMMAND"""
+    
+    def filter(self, message) -> bool:
+        return message.text is not None and not message.text.startswith('/')
+
+PLAIN_TEXT: Final = _PlainTextFilter()
+
+# Code fence wrapped around terminal output sent as Markdown
+_MD_PRE: Final[str] = "```\n"
+_MD_POST: Final[str] = "\n```"
+
+# Output whose tail matches this looks like a shell prompt waiting for input.
+# Matched against the last _PROMPT_WINDOW characters only, so adding patterns
+# keeps detection a single scan of a few characters
+_PROMPT_RE = re.compile(r'[$#>] $')
+_PROMPT_WINDOW = 4
+
+# ANSI escape sequences and control codes stripped from SSH output, fused
+# into one alternation so each chunk is scanned once
+_ANSI_RE = re.compile(
+    r'\x1b\][^\x07]*\x07'                  # OSC sequences (window title, etc)
+    r'|\x1b[PX^_].*?\x1b\\'                # DCS/SOS/PM/APC sequences
+    r'|\x1b\[[0-?]*[ -/]*[@-~]'            # CSI sequences (SGR, cursor, private modes)
+    r'|\x1b[NO]'                           # SS2/SS3
+    r'|[\x00-\x08\x0B-\x0C\x0E-\x1F]',     # Control chars except \t, \n, \r
+    re.DOTALL
+)
+
+class TelegramRateLimiter:
+    """Keep bot API calls under Telegram's flood limits (30/s global, ~1/s per chat)"""
+    
+    def __init__(self, global_rate: int = 30, min_interval: float = 1.0, max_interval: float = 2.0,
+                 max_retries: int = 3):
+        self.bot = None  # Set once the Application is built
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_retries = max_retries  # RetryAfter waits per call before giving up
+        self._global = asyncio.Semaphore(global_rate)  # Each slot is held for one second
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._last_call: Dict[int, float] = {}
+        self._intervals: Dict[int, float] = {}  # Per-chat gap, doubled on each 429
+        self._pending: Dict[Tuple[int, int], str] = {}  # Latest queued text per message
+        self._sent: Dict[Tuple[int, int], str] = {}  # Last text Telegram has per message
+    
+    async def call(self, chat_id: int, func, /, *args, **kwargs):
+        """Run a bot API call once both the per-chat and global budgets allow it"""
+        async with self._chat_locks.setdefault(chat_id, asyncio.Lock()):
+            return await self._call_locked(chat_id, func, *args, **kwargs)
+    
+    def interval(self, chat_id: int) -> float:
+        """Current minimum gap between calls to a chat"""
+        return self._intervals.get(chat_id, self.min_interval)
+    
+    async def _call_locked(self, chat_id: int, func, /, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        interval = self.interval(chat_id)
+        since_last = loop.time() - self._last_call.get(chat_id, 0.0)
+        await asyncio.sleep(max(0, interval - since_last))
+        retries = 0
+        while True:
+            # Every attempt, retries included, takes a slot from the global budget
+            await self._global.acquire()
+            loop.call_later(1.0, self._global.release)
+            try:
+                result = await func(*args, **kwargs)
+                break
+            except RetryAfter as e:
+                retries += 1
+                if retries > self.max_retries:
+                    raise
+                # Flood control kicked in anyway - back off and wait it out
+                self._intervals[chat_id] = min(self.max_interval, self.interval(chat_id) * 2)
+                await asyncio.sleep(e.retry_after)
+            finally:
+                self._last_call[chat_id] = loop.time()
+        if not retries and interval > self.min_interval:
+            # Ease back towards the minimum while calls go through
+            self._intervals[chat_id] = max(self.min_interval, interval * 0.9)
+        return result
+    
+    async def send(self, chat_id: int, text: str, **kwargs):
+        """Rate-limited send_message"""
+        msg = await self.call(chat_id, self.bot.send_message, chat_id=chat_id, text=text, **kwargs)
+        self._sent[(chat_id, msg.message_id)] = text
+        return msg
+    
+    async def edit(self, chat_id: int, message_id: int, text: str, **kwargs) -> bool:
+        """Rate-limited edit_message_text; edits superseded while queued are dropped"""
+        key = (chat_id, message_id)
+        self._pending[key] = text
+        async with self._chat_locks.setdefault(chat_id, asyncio.Lock()):
+            if self._pending.get(key) is not text:
+                return False  # A later edit carries a newer payload
+            del self._pending[key]
+            if self._sent.get(key) == text:
+                return False  # Telegram would reject it as "message is not modified"
+            await self._call_locked(chat_id, self.bot.edit_message_text,
+                                    chat_id=chat_id, message_id=message_id, text=text, **kwargs)
+            self._sent[key] = text
+            return True
+    
+    def forget(self, chat_id: int):
+        """Drop cached message state for a chat"""
+        self._last_call.pop(chat_id, None)
+        self._intervals.pop(chat_id, None)
+        lock = self._chat_locks.get(chat_id)
+        if lock is not None and not lock.locked():  # A call still in flight keeps it
+            del self._chat_locks[chat_id]
+        for cache in (self._sent, self._pending):
+            for key in [k for k in cache if k[0] == chat_id]:
+                del cache[key]
+
+rate_limiter = TelegramRateLimiter(min_interval=config.EDIT_INTERVAL_MIN, max_interval=config.EDIT_INTERVAL_MAX)
+
+# Give up on a single output edit after this long; the next flush carries newer text
+EDIT_TIMEOUT = 10.0
+
+# The only update types with handlers; Telegram doesn't send the rest
+ALLOWED_UPDATES: Final[List[str]] = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+# Unsent SSH output kept per session while Telegram is busy (bytes)
+OUTPUT_BACKLOG_LIMIT = 256 * 1024
+
+# chat_id -> (command lines waiting for the debounce timer, timer handle)
+_pending_input: Dict[int, Tuple[List[str], asyncio.TimerHandle]] = {}
+
+# Key-press callbacks mapped to the raw bytes written to the PTY
+_KEY_MAP: Final[Dict[str, bytes]] = {
+    'up': b'\x1b[A', 'down': b'\x1b[B',
+    'right': b'\x1b[C', 'left': b'\x1b[D',
+    'home': b'\x1b[H', 'end': b'\x1b[F',
+    'pgup': b'\x1b[5~', 'pgdn': b'\x1b[6~',
+    'tab': b'\t', 'shift+tab': b'\x1b[Z',
+    'enter': b'\r', 'esc': b'\x1b',
+    'backspace': b'\x7f', 'delete': b'\x1b[3~',
+    'space': b' ',
+    'ctrl+a': b'\x01', 'ctrl+b': b'\x02', 'ctrl+c': b'\x03',
+    'ctrl+d': b'\x04', 'ctrl+e': b'\x05', 'ctrl+f': b'\x06',
+    'ctrl+k': b'\x0b', 'ctrl+l': b'\x0c', 'ctrl+r': b'\x12',
+    'ctrl+u': b'\x15', 'ctrl+w': b'\x17', 'ctrl+z': b'\x1a',
+    'f1': b'\x1bOP', 'f2': b'\x1bOQ', 'f3': b'\x1bOR', 'f4': b'\x1bOS',
+    'f5': b'\x1b[15~', 'f6': b'\x1b[17~', 'f7': b'\x1b[18~', 'f8': b'\x1b[19~',
+    'f9': b'\x1b[20~', 'f10': b'\x1b[21~', 'f11': b'\x1b[23~', 'f12': b'\x1b[24~',
+}
 
 # ------------------------- AUTHENTICATION -------------------------
 
@@ -92,7 +257,7 @@ async def ensure_registered(update: Update) -> bool:
         return False
     
     # Auto-register user
-    db.get_or_create_user(
+    await adb.get_or_create_user(
         user_id=user.id,
         username=user.username,
         first_name=user.first_name,
@@ -100,16 +265,15 @@ async def ensure_registered(update: Update) -> bool:
     )
     return True
 
-# ------------------------- COMMAND HANDLERS -------------------------
+async def release_db_session(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Return the scoped DB session to the pool once an update is handled"""
+    db.remove_session()
 
-async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /start command"""
-    if not await ensure_registered(update):
-        return await update.message.reply_text("Failed to register. Please try again.")
-    
-    user = update.effective_user
-    welcome_text = f"""
-🚀 **Welcome to SSH Terminal Bot, {user.first_name}!**
+# ------------------------- MESSAGES -------------------------
+
+# Static texts, built once at import
+_WELCOME_TEMPLATE = """
+🚀 **Welcome to SSH Terminal Bot, {name}!**
 
 This bot allows you to securely manage and connect to your SSH servers directly from Telegram.
 
@@ -126,18 +290,9 @@ Use /connections to see saved connections
 Use /help for all available commands
 
 Your data is encrypted and isolated from other users.
-    """
-    
-    keyboard = keyboard_builder.main_menu()
-    await update.message.reply_text(
-        welcome_text,
-        parse_mode=ParseMode.MARKDOWN,
-        reply_markup=keyboard
-    )
+"""
 
-async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /help command"""
-    help_text = """
+_HELP_TEXT = """
 **SSH Terminal Bot Commands**
 
 **Connection Management:**
@@ -168,7 +323,72 @@ Regular messages - Send with newline
 • Set a default connection for quick access
 • Use web terminal for the best experience
 • Your credentials are encrypted and secure
+"""
+
+_MENU_HELP_TEXT = """
+**SSH Terminal Bot Commands**
+
+**Connection Management:**
+/add - Add new SSH connection
+/connections - List saved connections
+/connect <name> - Connect to saved server
+/delete <name> - Delete saved connection
+/setdefault <name> - Set default connection
+
+**Quick Actions:**
+/quick <host> [port] [user] - Quick connect (not saved)
+/disconnect - Close current SSH session
+/status - Show connection status
+
+**Other:**
+/help - Show this help
+/start - Show main menu
+"""
+
+_QUICK_TEXT = (
+    "**Quick Connect** (without saving)\n\n"
+    "Use: `/quick <host> [port] [username]`\n\n"
+    "Examples:\n"
+    "• `/quick example.com`\n"
+    "• `/quick 192.168.1.100 22 root`\n"
+    "• `/quick server.local 2222 admin`"
+)
+
+# Feature flags are fixed for the process, so only the per-user fields are
+# left to fill in
+_SETTINGS_TEMPLATE = f"""
+**⚙️ Settings**
+
+**User ID:** `{{user_id}}`
+**Registered:** {{registered}}
+**Connections:** {{connection_count}}
+
+**Features:**
+• Quick Connect: {'✅' if config.ALLOW_QUICK_CONNECT else '❌'}
+• Key Upload: {'✅' if config.ALLOW_KEY_UPLOAD else '❌'}
+• Multi-Sessions: {'✅' if config.ALLOW_MULTIPLE_SESSIONS else '❌'}
     """
+
+# ------------------------- COMMAND HANDLERS -------------------------
+
+async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /start command"""
+    if not await ensure_registered(update):
+        return await update.message.reply_text("Failed to register. Please try again.")
+    
+    user = update.effective_user
+    welcome_text = _WELCOME_TEMPLATE.format(name=user.first_name)
+    
+    keyboard = keyboard_builder.main_menu()
+    await update.message.reply_text(
+        welcome_text,
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=keyboard
+    )
+
+async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /help command"""
+    help_text = _HELP_TEXT
     
     await update.message.reply_text(
         help_text,
@@ -184,7 +404,7 @@ async def connections_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     user_id = update.effective_user.id
-    connections = connection_mgr.list_connections(user_id)
+    connections = await adb.run(connection_mgr.list_connections, user_id)
     
     if not connections:
         await update.message.reply_text(
@@ -194,11 +414,12 @@ async def connections_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Build connection list message
-    message = "**Your SSH Connections:**\n\n"
-    for conn in connections:
-        if conn.get('is_default'):
-            message += "⭐ "
-        message += f"`{conn['name']}` - {conn['username']}@{conn['host']}:{conn['port']}\n"
+    lines = ["**Your SSH Connections:**", ""]
+    lines.extend(
+        f"{'⭐ ' if conn.get('is_default') else ''}`{conn['name']}` - {conn['username']}@{conn['host']}:{conn['port']}"
+        for conn in connections
+    )
+    message = "\n".join(lines)
     
     keyboard = keyboard_builder.connections_list(connections)
     await update.message.reply_text(
@@ -212,15 +433,14 @@ async def connect_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await ensure_registered(update):
         return
     
-    args = update.message.text.split(maxsplit=1)
-    if len(args) < 2:
+    connection_name = _rest(update.message.text)
+    if not connection_name:
         await update.message.reply_text(
             "Usage: /connect <connection_name>\n"
             "Use /connections to see available connections."
         )
         return
     
-    connection_name = args[1]
     await connect_to_server(update, context, connection_name)
 
 async def connect_to_server(update: Update, context: ContextTypes.DEFAULT_TYPE, connection_name: str):
@@ -229,7 +449,7 @@ async def connect_to_server(update: Update, context: ContextTypes.DEFAULT_TYPE,
     chat_id = update.effective_chat.id
     
     # Check if connection exists
-    connection = db.get_connection(user_id, connection_name)
+    connection = await adb.get_connection(user_id, connection_name)
     if not connection:
         await update.effective_message.reply_text(
             f"Connection '{connection_name}' not found.\n"
@@ -277,17 +497,18 @@ async def quick_connect_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await ensure_registered(update):
         return
     
-    args = update.message.text.split()
-    if len(args) < 2:
+    rest = _rest(update.message.text)
+    if not rest:
         await update.message.reply_text(
             "Usage: /quick <host> [port] [username]\n"
             "Example: /quick example.com 22 root"
         )
         return
     
-    host = args[1]
-    port = int(args[2]) if len(args) > 2 and args[2].isdigit() else config.DEFAULT_SSH_PORT
-    username = args[3] if len(args) > 3 else config.DEFAULT_SSH_USER
+    args = rest.split(maxsplit=3)  # Anything past the username is ignored
+    host = args[0]
+    port = int(args[1]) if len(args) > 1 and args[1].isdigit() else config.DEFAULT_SSH_PORT
+    username = args[2] if len(args) > 2 else config.DEFAULT_SSH_USER
     chat_id = update.effective_chat.id
     
     await update.message.reply_text(f"🔄 Connecting to {username}@{host}:{port}...")
@@ -331,8 +552,10 @@ async def status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if session and session.is_alive():
         status = f"🟢 Connected to {session.username}@{session.host}:{session.port}"
-        if session.connection_id:
-            conn = db.get_connection_by_id(update.effective_user.id, session.connection_id)
+        if session.connection_name:
+            status += f"\nConnection: {session.connection_name}"
+        elif session.connection_id:
+            conn = await adb.get_connection_by_id(update.effective_user.id, session.connection_id)
             if conn:
                 status += f"\nConnection: {conn.name}"
     else:
@@ -345,14 +568,13 @@ async def delete_connection_cmd(update: Update, context: ContextTypes.DEFAULT_TY
     if not await ensure_registered(update):
         return
     
-    args = update.message.text.split(maxsplit=1)
-    if len(args) < 2:
+    connection_name = _rest(update.message.text)
+    if not connection_name:
         await update.message.reply_text(
             "Usage: /delete <connection_name>"
         )
         return
     
-    connection_name = args[1]
     user_id = update.effective_user.id
     
     keyboard = keyboard_builder.confirm_delete(connection_name)
@@ -366,17 +588,16 @@ async def setdefault_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await ensure_registered(update):
         return
     
-    args = update.message.text.split(maxsplit=1)
-    if len(args) < 2:
+    connection_name = _rest(update.message.text)
+    if not connection_name:
         await update.message.reply_text(
             "Usage: /setdefault <connection_name>"
         )
         return
     
-    connection_name = args[1]
     user_id = update.effective_user.id
     
-    if db.set_default_connection(user_id, connection_name):
+    if await adb.set_default_connection(user_id, connection_name):
         await update.message.reply_text(
             f"⭐ Connection '{connection_name}' is now your default."
         )
@@ -417,267 +638,290 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("✅ Authentication successful!")
         except:
             await update.message.reply_text("🔐 Waiting for authentication...")
-    else:
+    elif config.MESSAGE_DEBOUNCE_MS <= 0:
         # Normal command
         session.send(text + "\n")
+    else:
+        # Merge messages arriving within the debounce window into one write
+        queue_input(chat_id, text)
+
+def queue_input(chat_id: int, text: str):
+    """Buffer a command line for a chat and (re)start its debounce timer"""
+    lines, timer = _pending_input.get(chat_id, ([], None))
+    if timer:
+        timer.cancel()
+    lines.append(text)
+    timer = asyncio.get_running_loop().call_later(
+        config.MESSAGE_DEBOUNCE_MS / 1000, flush_input, chat_id
+    )
+    _pending_input[chat_id] = (lines, timer)
+
+def flush_input(chat_id: int):
+    """Send buffered command lines to the chat's SSH session in one write"""
+    lines, _ = _pending_input.pop(chat_id, ([], None))
+    session = ssh_manager.sessions.get(chat_id)
+    if lines and session and session.is_alive():
+        session.send("\n".join(lines) + "\n")
 
 # ------------------------- CALLBACK HANDLERS -------------------------
 
-async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle inline keyboard callbacks"""
+async def _cb_menu_main(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int,
+                        session, arg: str):
+    """Show the main menu"""
     query = update.callback_query
-    await query.answer()
-    
-    if not await ensure_registered(update):
-        return
-    
-    user_id = update.effective_user.id
-    chat_id = update.effective_chat.id
-    data = query.data
-    
-    # Main menu callbacks
-    if data == "menu_main":
-        keyboard = keyboard_builder.main_menu()
+    keyboard = keyboard_builder.main_menu()
+    await query.edit_message_text(
+        "Choose an action:",
+        reply_markup=keyboard
+    )
+
+async def _cb_menu_add(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int,
+                       session, arg: str):
+    """Point to the /add wizard"""
+    query = update.callback_query
+    await query.edit_message_text(
+        "To add a new SSH connection, use the /add command.\n"
+        "I'll guide you through the setup process step by step.\n\n"
+        "Type /add to start."
+    )
+
+async def _cb_menu_quick(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int,
+                         session, arg: str):
+    """Explain quick connect"""
+    query = update.callback_query
+    await query.edit_message_text(_QUICK_TEXT, parse_mode=ParseMode.MARKDOWN)
+
+async def _cb_menu_settings(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int,
+                            session, arg: str):
+    """Show user settings"""
+    query = update.callback_query
+    user = await adb.get_user(user_id)
+    settings_text = _SETTINGS_TEMPLATE.format(
+        user_id=user_id,
+        registered=user.registered_at.strftime('%Y-%m-%d'),
+        connection_count=await adb.count_connections(user_id)
+    )
+    await query.edit_message_text(
+        settings_text,
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=keyboard_builder.main_menu()
+    )
+
+async def _cb_menu_connect(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int,
+                           session, arg: str):
+    """List connections to connect to"""
+    query = update.callback_query
+    connections = await adb.run(connection_mgr.list_connections, user_id)
+    if not connections:
+        await query.edit_message_text(
+            "You don't have any saved connections yet.\n"
+            "Use /add to add your first connection!"
+        )
+    else:
+        keyboard = keyboard_builder.connections_list(connections, prefix="connect")
         await query.edit_message_text(
-            "Choose an action:",
+            "Select a connection:",
             reply_markup=keyboard
         )
-    
-    elif data == "menu_add":
+
+async def _cb_connect(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int,
+                      session, arg: str):
+    """Connect to a saved connection by ID"""
+    query = update.callback_query
+    connection_id = int(arg)
+    connection = await adb.get_connection_by_id(user_id, connection_id)
+    if connection:
+        await query.edit_message_text(f"Connecting to {connection.name}...")
+        await connect_to_server(update, context, connection.name)
+
+async def _cb_menu_list(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int,
+                        session, arg: str):
+    """List connections to manage"""
+    query = update.callback_query
+    connections = await adb.run(connection_mgr.list_connections, user_id)
+    if not connections:
         await query.edit_message_text(
-            "To add a new SSH connection, use the /add command.\n"
-            "I'll guide you through the setup process step by step.\n\n"
-            "Type /add to start."
+            "You don't have any saved connections yet."
         )
-        return
-    
-    elif data == "menu_quick":
+    else:
+        keyboard = keyboard_builder.connections_list(connections, prefix="manage")
         await query.edit_message_text(
-            "**Quick Connect** (without saving)\n\n"
-            "Use: `/quick <host> [port] [username]`\n\n"
-            "Examples:\n"
-            "• `/quick example.com`\n"
-            "• `/quick 192.168.1.100 22 root`\n"
-            "• `/quick server.local 2222 admin`",
-            parse_mode=ParseMode.MARKDOWN
+            "Select a connection to manage:",
+            reply_markup=keyboard
         )
-        return
-    
-    elif data == "menu_settings":
-        user_id = update.effective_user.id
-        user = db.get_user(user_id)
-        settings_text = f"""
-**⚙️ Settings**
 
-**User ID:** `{user_id}`
-**Registered:** {user.registered_at.strftime('%Y-%m-%d')}
-**Connections:** {len(db.get_connections(user_id))}
+async def _cb_manage(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int,
+                     session, arg: str):
+    """Show actions for a saved connection"""
+    query = update.callback_query
+    connection_id = int(arg)
+    connection = await adb.get_connection_by_id(user_id, connection_id)
+    if connection:
+        keyboard = keyboard_builder.connection_actions(connection.name)
+        info = format_connection_info(connection.to_dict())
+        await query.edit_message_text(
+            info,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=keyboard
+        )
 
-**Features:**
-• Quick Connect: {'✅' if config.ALLOW_QUICK_CONNECT else '❌'}
-• Key Upload: {'✅' if config.ALLOW_KEY_UPLOAD else '❌'}
-• Multi-Sessions: {'✅' if config.ALLOW_MULTIPLE_SESSIONS else '❌'}
-        """
+async def _cb_confirm_delete(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int,
+                             session, arg: str):
+    """Delete a saved connection"""
+    query = update.callback_query
+    connection_name = arg
+    if await adb.delete_connection(user_id, connection_name):
+        keyboard_builder.forget_connections()
         await query.edit_message_text(
-            settings_text,
+            f"✅ Connection '{connection_name}' deleted."
+        )
+    else:
+        await query.edit_message_text(
+            f"Failed to delete connection."
+        )
+
+async def _cb_session_disconnect(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int,
+                                 session, arg: str):
+    """Disconnect the SSH session"""
+    query = update.callback_query
+    host = ssh_manager.disconnect(chat_id)
+    if host:
+        await query.edit_message_text(f"✅ Disconnected from {host}")
+    else:
+        await query.edit_message_text("No active connection.")
+
+async def _cb_session_tui(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int,
+                          session, arg: str):
+    """Switch to TUI mode"""
+    query = update.callback_query
+    if session:
+        keyboard = keyboard_builder.tui_navigation()
+        await query.edit_message_text(
+            "🖥️ **TUI Mode Active**\n\n"
+            "Use the buttons below to navigate.\n"
+            "Send text messages to type commands.",
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=keyboard_builder.main_menu()
+            reply_markup=keyboard
         )
-        return
-    
-    elif data == "menu_connect":
-        connections = connection_mgr.list_connections(user_id)
-        if not connections:
-            await query.edit_message_text(
-                "You don't have any saved connections yet.\n"
-                "Use /add to add your first connection!"
-            )
-        else:
-            keyboard = keyboard_builder.connections_list(connections, prefix="connect")
-            await query.edit_message_text(
-                "Select a connection:",
-                reply_markup=keyboard
-            )
-    
-    elif data.startswith("connect:"):
-        connection_id = int(data.split(":")[1])
-        connection = db.get_connection_by_id(user_id, connection_id)
-        if connection:
-            await query.edit_message_text(f"Connecting to {connection.name}...")
-            await connect_to_server(update, context, connection.name)
-    
-    elif data == "menu_list":
-        connections = connection_mgr.list_connections(user_id)
-        if not connections:
-            await query.edit_message_text(
-                "You don't have any saved connections yet."
-            )
-        else:
-            keyboard = keyboard_builder.connections_list(connections, prefix="manage")
-            await query.edit_message_text(
-                "Select a connection to manage:",
-                reply_markup=keyboard
-            )
-    
-    elif data.startswith("manage:"):
-        connection_id = int(data.split(":")[1])
-        connection = db.get_connection_by_id(user_id, connection_id)
-        if connection:
-            keyboard = keyboard_builder.connection_actions(connection.name)
-            info = format_connection_info(connection.to_dict())
-            await query.edit_message_text(
-                info,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=keyboard
-            )
-    
-    elif data.startswith("confirm_delete:"):
-        connection_name = data.split(":")[1]
-        if db.delete_connection(user_id, connection_name):
-            await query.edit_message_text(
-                f"✅ Connection '{connection_name}' deleted."
-            )
-        else:
-            await query.edit_message_text(
-                f"Failed to delete connection."
-            )
-    
-    elif data == "session_disconnect":
-        host = ssh_manager.disconnect(chat_id)
-        if host:
-            await query.edit_message_text(f"✅ Disconnected from {host}")
-        else:
-            await query.edit_message_text("No active connection.")
-    
-    elif data == "session_tui":
-        # Switch to TUI mode with control buttons
-        session = ssh_manager.get(chat_id)
-        if session:
-            keyboard = keyboard_builder.tui_navigation()
-            await query.edit_message_text(
-                "🖥️ **TUI Mode Active**\n\n"
-                "Use the buttons below to navigate.\n"
-                "Send text messages to type commands.",
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=keyboard
-            )
-        else:
-            await query.edit_message_text("No active SSH connection.")
-    
-    elif data == "session_webapp" or data == "webapp:launch":
-        # Launch web terminal
-        if not config.WEBAPP_URL:
-            await query.edit_message_text(
-                "Web terminal is not configured.\n"
-                "Please set WEBAPP_URL in your environment."
-            )
-        else:
-            from telegram import WebAppInfo
-            
-            # Check if there's an active SSH session to include session_id
-            session = ssh_manager.get(chat_id)
-            if session and session.is_alive() and session.session_id:
-                webapp_url = f"{config.WEBAPP_URL}?user_id={user_id}&session_id={session.session_id}"
-            else:
-                webapp_url = f"{config.WEBAPP_URL}?user_id={user_id}"
-            
-            keyboard = InlineKeyboardMarkup([[
-                InlineKeyboardButton(
-                    "🌐 Open Web Terminal",
-                    web_app=WebAppInfo(url=webapp_url)
-                )
-            ]])
-            await query.edit_message_text(
-                "Click below to open the web terminal:",
-                reply_markup=keyboard
-            )
-    
-    elif data.startswith("key:"):
-        # Handle key presses
-        key = data[4:]  # Remove "key:" prefix
-        session = ssh_manager.get(chat_id)
-        if session and session.is_alive():
-            # Map special keys to terminal sequences
-            key_map = {
-                'up': '\x1b[A', 'down': '\x1b[B', 
-                'right': '\x1b[C', 'left': '\x1b[D',
-                'home': '\x1b[H', 'end': '\x1b[F',
-                'pgup': '\x1b[5~', 'pgdn': '\x1b[6~',
-                'tab': '\t', 'shift+tab': '\x1b[Z',
-                'enter': '\r', 'esc': '\x1b',
-                'backspace': '\x7f', 'delete': '\x1b[3~',
-                'space': ' ',
-                'ctrl+a': '\x01', 'ctrl+b': '\x02', 'ctrl+c': '\x03',
-                'ctrl+d': '\x04', 'ctrl+e': '\x05', 'ctrl+f': '\x06',
-                'ctrl+k': '\x0b', 'ctrl+l': '\x0c', 'ctrl+r': '\x12',
-                'ctrl+u': '\x15', 'ctrl+w': '\x17', 'ctrl+z': '\x1a',
-                'f1': '\x1bOP', 'f2': '\x1bOQ', 'f3': '\x1bOR', 'f4': '\x1bOS',
-                'f5': '\x1b[15~', 'f6': '\x1b[17~', 'f7': '\x1b[18~', 'f8': '\x1b[19~',
-                'f9': '\x1b[20~', 'f10': '\x1b[21~', 'f11': '\x1b[23~', 'f12': '\x1b[24~',
-            }
-            
-            if key in key_map:
-                session.child.send(key_map[key])
-                await query.answer(f"Sent: {key}")
-            else:
-                await query.answer(f"Unknown key: {key}")
+    else:
+        await query.edit_message_text("No active SSH connection.")
+
+async def _cb_session_webapp(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int,
+                             session, arg: str):
+    """Offer the web terminal"""
+    query = update.callback_query
+    if not config.WEBAPP_URL:
+        await query.edit_message_text(
+            "Web terminal is not configured.\n"
+            "Please set WEBAPP_URL in your environment."
+        )
+    else:
+        from telegram import WebAppInfo
+
+        # Check if there's an active SSH session to include session_id
+        if session and session.is_alive() and session.session_id:
+            webapp_url = f"{config.WEBAPP_URL}?user_id={user_id}&session_id={session.session_id}"
         else:
-            await query.answer("No active SSH connection", show_alert=True)
-    
-    elif data.startswith("kbd:"):
-        # Switch keyboard layouts
-        kbd_type = data[4:]  # Remove "kbd:" prefix
-        session = ssh_manager.get(chat_id)
-        if session:
-            if kbd_type == "navigation":
-                keyboard = keyboard_builder.tui_navigation()
-                text = "🖥️ **TUI Navigation Mode**"
-            elif kbd_type == "ctrl":
-                keyboard = keyboard_builder.tui_ctrl()
-                text = "🎛️ **Ctrl Key Combinations**"
-            elif kbd_type == "special":
-                keyboard = keyboard_builder.tui_special()
-                text = "⚡ **Special Keys**"
-            elif kbd_type == "function":
-                keyboard = keyboard_builder.tui_function()
-                text = "🔧 **Function Keys**"
-            else:
-                keyboard = keyboard_builder.tui_navigation()
-                text = "🖥️ **TUI Mode**"
-            
-            await query.edit_message_text(
-                text,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=keyboard
+            webapp_url = f"{config.WEBAPP_URL}?user_id={user_id}"
+
+        keyboard = InlineKeyboardMarkup([[
+            InlineKeyboardButton(
+                "🌐 Open Web Terminal",
+                web_app=WebAppInfo(url=webapp_url)
             )
-        else:
-            await query.answer("No active SSH connection", show_alert=True)
-    
-    elif data == "menu_help":
-        help_text = """
-**SSH Terminal Bot Commands**
+        ]])
+        await query.edit_message_text(
+            "Click below to open the web terminal:",
+            reply_markup=keyboard
+        )
 
-**Connection Management:**
-/add - Add new SSH connection
-/connections - List saved connections
-/connect <name> - Connect to saved server
-/delete <name> - Delete saved connection
-/setdefault <name> - Set default connection
+async def _cb_key(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int,
+                  session, arg: str):
+    """Send a special key to the SSH session"""
+    query = update.callback_query
+    key = arg
+    if session and session.is_alive():
+        seq = _KEY_MAP.get(key)
+        if seq is not None:
+            # Write straight to the PTY, skipping pexpect's str encoding
+            os.write(session.child.child_fd, seq)
+            await query.answer(f"Sent: {key}")
+        else:
+            await query.answer(f"Unknown key: {key}")
+    else:
+        await query.answer("No active SSH connection", show_alert=True)
 
-**Quick Actions:**
-/quick <host> [port] [user] - Quick connect (not saved)
-/disconnect - Close current SSH session
-/status - Show connection status
+# TUI keyboard layouts by "kbd:<name>" callback, with their headings (built at import)
+_TUI_LAYOUTS: Final[dict] = {
+    "navigation": ("🖥️ **TUI Navigation Mode**", keyboard_builder.tui_navigation()),
+    "ctrl": ("🎛️ **Ctrl Key Combinations**", keyboard_builder.tui_ctrl()),
+    "special": ("⚡ **Special Keys**", keyboard_builder.tui_special()),
+    "function": ("🔧 **Function Keys**", keyboard_builder.tui_function()),
+}
+_TUI_DEFAULT_LAYOUT: Final = ("🖥️ **TUI Mode**", keyboard_builder.tui_navigation())
 
-**Other:**
-/help - Show this help
-/start - Show main menu
-        """
+async def _cb_kbd(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int,
+                  session, arg: str):
+    """Switch TUI keyboard layouts"""
+    query = update.callback_query
+    if session:
+        text, keyboard = _TUI_LAYOUTS.get(arg, _TUI_DEFAULT_LAYOUT)
         await query.edit_message_text(
-            help_text,
+            text,
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=keyboard_builder.main_menu()
+            reply_markup=keyboard
         )
+    else:
+        await query.answer("No active SSH connection", show_alert=True)
+
+async def _cb_menu_help(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, chat_id: int,
+                        session, arg: str):
+    """Show help"""
+    query = update.callback_query
+    await query.edit_message_text(
+        _MENU_HELP_TEXT,
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=keyboard_builder.main_menu()
+    )
+
+# Callback data is "name" or "name:arg"; the name alone picks the handler
+_CALLBACKS: Final[dict] = {
+    "menu_main": _cb_menu_main,
+    "menu_add": _cb_menu_add,
+    "menu_quick": _cb_menu_quick,
+    "menu_settings": _cb_menu_settings,
+    "menu_connect": _cb_menu_connect,
+    "menu_list": _cb_menu_list,
+    "session_disconnect": _cb_session_disconnect,
+    "session_tui": _cb_session_tui,
+    "session_webapp": _cb_session_webapp,
+    "webapp": _cb_session_webapp,  # "webapp:launch"
+    "menu_help": _cb_menu_help,
+    "connect": _cb_connect,
+    "manage": _cb_manage,
+    "confirm_delete": _cb_confirm_delete,
+    "key": _cb_key,
+    "kbd": _cb_kbd,
+}
+
+async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle inline keyboard callbacks"""
+    query = update.callback_query
+    await query.answer()
+    
+    if not await ensure_registered(update):
+        return
+    
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    data = query.data
+    session = ssh_manager.sessions.get(chat_id)  # Looked up once for every handler
+    
+    # One dict lookup instead of walking an if/elif chain or matching patterns
+    name, _, arg = data.partition(":")
+    handler = _CALLBACKS.get(name)
+    if handler:
+        await handler(update, context, user_id, chat_id, session, arg)
 
 # ------------------------- OUTPUT STREAMING -------------------------
 
@@ -687,14 +931,61 @@ async def tail_output(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
     if not session:
         return
     
-    buffer = ""
-    last_send_time = asyncio.get_event_loop().time()
-    min_interval = 1.0  # Reduced interval for more responsive output
+    loop = asyncio.get_running_loop()
+    now = loop.time  # Bound once; called on every chunk
+    
+    buffer = []  # Pending output chunks, joined only when flushed
+    buffer_len = 0
+    buffer_tail = ""  # Last few characters of pending output, for prompt detection
+    last_send_time = now()
     last_message_id = None  # Track the last output message
     keyboard_message_id = None  # Track the keyboard message
-    accumulated_output = ""  # Keep all output for editing
-    
-    # Send initial keyboard
+    accumulated = deque()  # Displayed output chunks, trimmed from the left
+    accumulated_len = 0
+    truncated = False
+    max_display = 3500  # Keep only last N characters to avoid message getting too long
+    
+    def accumulate(text: str):
+        """Append flushed output, keeping only the last max_display characters"""
+        nonlocal accumulated_len, truncated
+        accumulated.append(text)
+        accumulated_len += len(text)
+        if accumulated_len > max_display:
+            truncated = True
+            while accumulated_len - len(accumulated[0]) >= max_display:
+                accumulated_len -= len(accumulated.popleft())
+            excess = accumulated_len - max_display
+            if excess:
+                accumulated[0] = accumulated[0][excess:]
+                accumulated_len -= excess
+    
+    async def show(text: str):
+        """Put text in the output message (edit in place, or send the first one)"""
+        nonlocal last_message_id
+        if session.markdown_ok:
+            payload, parse_mode = _MD_PRE + text + _MD_POST, ParseMode.MARKDOWN
+        else:
+            payload, parse_mode = text, None
+        try:
+            if last_message_id:
+                await rate_limiter.edit(chat_id, last_message_id, payload, parse_mode=parse_mode)
+            else:
+                msg = await rate_limiter.send(chat_id, payload, parse_mode=parse_mode)
+                last_message_id = msg.message_id
+        except BadRequest as e:
+            if not session.markdown_ok or "can't parse entities" not in str(e).lower():
+                raise
+            # This output breaks Markdown; use plain text for the rest of the session
+            session.markdown_ok = False
+            await show(text)
+    
+    def accumulated_text() -> str:
+        text = ''.join(accumulated)
+        # Mark that older output was dropped
+        return "...\n" + text if truncated else text
+    
+    # Send the controls once; the message stays put instead of being
+    # deleted and re-sent below every output update
     try:
         keyboard_msg = await context.bot.send_message(
             chat_id=chat_id,
@@ -706,141 +997,164 @@ async def tail_output(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
     except:
         pass
     
-    while session and session.is_alive():
+    # Drain the PTY from an event-loop reader callback instead of polling it.
+    # The callback keeps reading while this coroutine waits on Telegram, into a
+    # raw byte backlog bounded to OUTPUT_BACKLOG_LIMIT (oldest bytes dropped; only
+    # the tail is ever displayed) so a flood can't overrun the PTY or memory.
+    # Bytes are decoded only when handed over, so dropped output is never decoded
+    child_fd = session.child.child_fd
+    backlog = bytearray()
+    backlog_dropped = False
+    at_eof = False
+    output_ready = asyncio.Event()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    
+    def on_readable():
+        nonlocal backlog_dropped, at_eof
         try:
-            # Check for output
-            output = session.child.read_nonblocking(size=4096, timeout=0)
-            if output:
+            data = os.read(child_fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''  # EIO: the SSH process has exited
+        if not data:
+            loop.remove_reader(child_fd)
+            at_eof = True
+        else:
+            backlog.extend(data)
+            excess = len(backlog) - OUTPUT_BACKLOG_LIMIT
+            if excess > 0:
+                del backlog[:excess]
+                backlog_dropped = True
+        output_ready.set()
+    
+    try:
+        loop.add_reader(child_fd, on_readable)
+        use_reader = True
+    except (NotImplementedError, ValueError):
+        use_reader = False
+    
+    def read_blocking() -> Optional[str]:
+        """Fallback for loops without add_reader support (runs in a worker thread)"""
+        try:
+            return session.child.read_nonblocking(size=65536, timeout=config.POLL_INTERVAL)
+        except pexpect.TIMEOUT:
+            return ""
+        except pexpect.EOF:
+            return None
+    
+    async def next_output() -> Optional[str]:
+        """Wait up to one poll interval for output; None means EOF"""
+        nonlocal backlog_dropped
+        if not use_reader:
+            return await loop.run_in_executor(None, read_blocking)
+        if not backlog:
+            if at_eof:
+                return None
+            try:
+                await asyncio.wait_for(output_ready.wait(), config.POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                return ""
+        output_ready.clear()
+        if not backlog:
+            return None if at_eof else ""
+        # Hand everything that arrived since the last wake-up over in one piece
+        text = decoder.decode(backlog)
+        if backlog_dropped:
+            text = "\n[... output skipped ...]\n" + text
+        backlog.clear()
+        backlog_dropped = False
+        return text
+    
+    try:
+        while session and session.is_alive():
+            output = await next_output()
+            if output is None:
+                break
+            if not output:
+                continue
+            
+            try:
                 # Filter out common ANSI escape sequences and control codes
                 # Note: Complex TUI apps like tmux/vim work better in web terminal
                 original_output = output
                 
-                # Comprehensive ANSI filtering
-                # Remove all CSI sequences (the most common ANSI escape sequences)
-                output = re.sub(r'\x1b\[[^m]*m', '', output)  # Remove all SGR sequences
-                output = re.sub(r'\x1b\[[0-9;?]*[A-Za-z]', '', output)  # Remove all CSI sequences
-                output = re.sub(r'\x1b\].*?\x07', '', output)  # OSC sequences (window title, etc)
-                output = re.sub(r'\x1b[PX^_].*?\x1b\\', '', output)  # DCS/SOS/PM/APC sequences
-                output = re.sub(r'\x1b\[[\?!][0-9;]*[a-zA-Z]', '', output)  # Private sequences
-                output = re.sub(r'\x1b[NO]', '', output)  # SS2/SS3
-                output = re.sub(r'[\x00-\x08\x0B-\x0C\x0E-\x1F]', '', output)  # Control chars except \t, \n, \r
+                # Comprehensive ANSI filtering (single pass)
+                output = _ANSI_RE.sub('', output)
                 
                 # Detect if this looks like a TUI app (lots of escape codes)
                 escape_ratio = len(original_output) - len(output)
-                if escape_ratio > len(output) * 0.5 and not hasattr(session, 'tui_warning_shown'):
+                if escape_ratio > len(output) * 0.5 and not session.tui_warning_shown:
                     # Suggest web terminal for better experience (only once per session)
-                    buffer += "\n💡 Tip: Complex TUI apps work better in the web terminal. Use /webapp command.\n"
+                    tip = "\n💡 Tip: Complex TUI apps work better in the web terminal. Use /webapp command.\n"
+                    buffer.append(tip)
+                    buffer_len += len(tip)
                     session.tui_warning_shown = True
                 
-                buffer += output
+                buffer.append(output)
+                buffer_len += len(output)
+                # Only the last few characters are kept; avoid copying the whole chunk
+                if len(output) >= _PROMPT_WINDOW:
+                    buffer_tail = output[-_PROMPT_WINDOW:]
+                else:
+                    buffer_tail = (buffer_tail + output)[-_PROMPT_WINDOW:]
                 
                 # Send if buffer is large enough or enough time has passed
-                current_time = asyncio.get_event_loop().time()
+                current_time = now()
                 time_since_last = current_time - last_send_time
                 
                 # Only send if we have waited long enough and have content
                 # Also send immediately if buffer ends with common prompt patterns
-                prompt_patterns = ['\n$ ', '\n# ', '\n> ', '$ ', '# ', '> ']
-                has_prompt = any(buffer.endswith(p) for p in prompt_patterns)
+                has_prompt = _PROMPT_RE.search(buffer_tail) is not None
                 
-                if buffer and (len(buffer) > 3000 or time_since_last > min_interval or has_prompt):
+                # Flush no faster than the chat's (adaptive) edit interval allows
+                if buffer_len and (buffer_len > 3000 or time_since_last > rate_limiter.interval(chat_id) or has_prompt):
                     # Add to accumulated output
-                    accumulated_output += buffer
-                    
-                    # Keep only last N characters to avoid message getting too long
-                    max_display = 3500
-                    if len(accumulated_output) > max_display:
-                        # Keep the last portion and add ellipsis
-                        accumulated_output = "...\n" + accumulated_output[-max_display:]
-                    
-                    # Format the message
-                    display_text = f"```\n{accumulated_output}\n```"
+                    accumulate(''.join(buffer))
+                    accumulated_output = accumulated_text()
                     
                     try:
                         if last_message_id:
-                            # Try to edit existing message
+                            # Try to edit existing message (throttled and coalesced)
                             try:
-                                await context.bot.edit_message_text(
-                                    chat_id=chat_id,
-                                    message_id=last_message_id,
-                                    text=display_text,
-                                    parse_mode=ParseMode.MARKDOWN
-                                )
+                                await asyncio.wait_for(show(accumulated_output), EDIT_TIMEOUT)
+                            except asyncio.TimeoutError:
+                                pass  # Don't stall the stream; the next flush retries
                             except Exception as e:
                                 # If edit fails, send new message
                                 if "message is not modified" not in str(e).lower():
-                                    msg = await context.bot.send_message(
-                                        chat_id=chat_id,
-                                        text=display_text,
-                                        parse_mode=ParseMode.MARKDOWN
-                                    )
-                                    last_message_id = msg.message_id
+                                    last_message_id = None
+                                    await show(accumulated_output)
                         else:
                             # First message - send new
-                            msg = await context.bot.send_message(
-                                chat_id=chat_id,
-                                text=display_text,
-                                parse_mode=ParseMode.MARKDOWN
-                            )
-                            last_message_id = msg.message_id
-                        
-                        # Move keyboard to bottom if needed
-                        if keyboard_message_id:
-                            try:
-                                await context.bot.delete_message(chat_id=chat_id, message_id=keyboard_message_id)
-                                keyboard_msg = await context.bot.send_message(
-                                    chat_id=chat_id,
-                                    text="🖥️ **Terminal Controls**",
-                                    parse_mode=ParseMode.MARKDOWN,
-                                    reply_markup=keyboard_builder.session_actions()
-                                )
-                                keyboard_message_id = keyboard_msg.message_id
-                            except:
-                                pass
+                            await show(accumulated_output)
                     except Exception as e:
-                        # If accumulated output is too long, save as file
-                        if len(accumulated_output) > config.TG_MESSAGE_LIMIT:
-                            output_file = io.BytesIO(accumulated_output.encode('utf-8'))
-                            output_file.name = "terminal_output.txt"
-                            output_file.seek(0)
-                            
-                            try:
-                                await context.bot.send_document(
-                                    chat_id=chat_id,
-                                    document=output_file,
-                                    caption="📄 Terminal output (saved to file)",
-                                    filename=f"terminal_output_{datetime.now().strftime('%H%M%S')}.txt"
-                                )
-                                # Clear accumulated output after saving to file
-                                accumulated_output = ""
-                                last_message_id = None
-                            except:
-                                pass
+                        # Output is capped at max_display, so it always fits one message
+                        logger.warning(f"Failed to show output for chat {chat_id}: {e}")
                     
-                    buffer = ""
+                    buffer.clear()
+                    buffer_len = 0
+                    buffer_tail = ""
                     last_send_time = current_time
-        except:
-            pass
-        
-        await asyncio.sleep(config.POLL_INTERVAL)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Failed to relay SSH output for chat {chat_id}: {e}")
+    except asyncio.CancelledError:
+        # Disconnected by the user: skip the final flush, but don't leave the
+        # chat's rate limiter state behind for the next connection
+        rate_limiter.forget(chat_id)
+        raise
+    finally:
+        if use_reader:
+            loop.remove_reader(child_fd)
     
     # Send any remaining buffer
     if buffer:
-        accumulated_output += buffer
+        accumulate(''.join(buffer))
+        accumulated_output = accumulated_text()
         try:
-            if last_message_id:
-                await context.bot.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=last_message_id,
-                    text=f"```\n{accumulated_output}\n```",
-                    parse_mode=ParseMode.MARKDOWN
-                )
-            else:
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=f"```\n{accumulated_output}\n```",
-                    parse_mode=ParseMode.MARKDOWN
-                )
+            await show(accumulated_output)
         except:
             pass
     
@@ -850,6 +1164,13 @@ async def tail_output(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
             await context.bot.delete_message(chat_id=chat_id, message_id=keyboard_message_id)
         except:
             pass
+    
+    rate_limiter.forget(chat_id)
+    
+    # The remote side closed the session; release the PTY and temp key file
+    if ssh_manager.get(chat_id) is session:
+        session.task = None  # Nothing left to cancel
+        ssh_manager.disconnect(chat_id)
 
 # ------------------------- WEBAPP COMMAND -------------------------
 
@@ -881,40 +1202,73 @@ async def webapp_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ------------------------- MAIN -------------------------
 
+# Slash commands and their handlers (/add is handled by the ConversationHandler wizard)
+_COMMANDS: Final[Tuple[Tuple[str, object], ...]] = (
+    ("start", start_cmd),
+    ("help", help_cmd),
+    ("connections", connections_cmd),
+    ("connect", connect_cmd),
+    ("quick", quick_connect_cmd),
+    ("disconnect", disconnect_cmd),
+    ("status", status_cmd),
+    ("delete", delete_connection_cmd),
+    ("setdefault", setdefault_cmd),
+    ("webapp", webapp_cmd),
+)
+
 def main():
     """Main function"""
+    if HAS_UVLOOP:
+        uvloop.install()  # Before the Application creates its loop
+    
     # Create application
-    application = Application.builder().token(config.TELEGRAM_TOKEN).build()
+    # Keep-alive connection pool so edits and sends reuse one TLS connection
+    application = (
+        Application.builder()
+        .token(config.TELEGRAM_TOKEN)
+        .request(HTTPXRequest(http_version=BOT_API_HTTP_VERSION, connection_pool_size=64))
+        .get_updates_request(HTTPXRequest(http_version=BOT_API_HTTP_VERSION))
+        .build()
+    )
+    rate_limiter.bot = application.bot
     
     # Add connection wizard FIRST (higher priority)
-    wizard = ConnectionWizard(db, encryption)
+    wizard = ConnectionWizard(db, encryption, connection_mgr)
     application.add_handler(wizard.get_handler())
     
     # Add command handlers
-    application.add_handler(CommandHandler("start", start_cmd))
-    application.add_handler(CommandHandler("help", help_cmd))
-    # Note: /add is handled by the ConversationHandler wizard above
-    application.add_handler(CommandHandler("connections", connections_cmd))
-    application.add_handler(CommandHandler("connect", connect_cmd))
-    application.add_handler(CommandHandler("quick", quick_connect_cmd))
-    application.add_handler(CommandHandler("disconnect", disconnect_cmd))
-    application.add_handler(CommandHandler("status", status_cmd))
-    application.add_handler(CommandHandler("delete", delete_connection_cmd))
-    application.add_handler(CommandHandler("setdefault", setdefault_cmd))
-    application.add_handler(CommandHandler("webapp", webapp_cmd))
+    application.add_handlers([CommandHandler(name, callback) for name, callback in _COMMANDS])
     
     # Add callback handler
     application.add_handler(CallbackQueryHandler(callback_handler))
     
     # Add message handler LAST (lowest priority)
     application.add_handler(MessageHandler(
-        filters.TEXT & ~filters.COMMAND,
+        PLAIN_TEXT,
         message_handler
     ))
     
+    # Release the DB session after all other handlers have run
+    application.add_handler(TypeHandler(Update, release_db_session), group=1)
+    
+    # Prune old audit entries in the background
+    db.start_maintenance(config.AUDIT_LOG_RETENTION_DAYS)
+    
     # Start bot
     logger.info("Starting SSH Terminal Bot...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if config.WEBHOOK_URL:
+        # Telegram pushes updates over a connection it keeps open, no getUpdates round-trips
+        application.run_webhook(
+            listen=config.WEBHOOK_LISTEN,
+            port=config.WEBHOOK_PORT,
+            url_path=config.TELEGRAM_TOKEN,
+            webhook_url=f"{config.WEBHOOK_URL.rstrip('/')}/{config.TELEGRAM_TOKEN}",
+            secret_token=config.WEBHOOK_SECRET_TOKEN or None,
+            allowed_updates=ALLOWED_UPDATES,
+            drop_pending_updates=True
+        )
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES, drop_pending_updates=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -2,12 +2,60 @@
 Encryption utilities for storing sensitive data
 """
 import os
-import base64
+import secrets
+import logging
+import functools
 from typing import Optional
-from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
+try:
+    import pybase64 as base64  # SIMD base64, same API as the stdlib module
+except ImportError:
+    import base64
+
+try:
+    import rfernet  # Rust Fernet, several times faster on small tokens
+    HAS_RFERNET = True
+except ImportError:
+    HAS_RFERNET = False
+
+logger = logging.getLogger(__name__)
+
+# Per-user cipher instances kept so the key derivation runs once per user
+FERNET_CACHE_SIZE = 512
+
+# Values written as AES-256-GCM: this prefix, then urlsafe base64 of nonce + ciphertext.
+# The colon can't occur in base64, so older Fernet values never match
+AESGCM_PREFIX = "v2:"
+AESGCM_NONCE_SIZE = 12
+
+class _RustFernet:
+    """rfernet behind the cryptography.fernet API (bytes in and out, InvalidToken)"""
+    
+    def __init__(self, key: bytes):
+        self._fernet = rfernet.Fernet(key.decode())
+    
+    def encrypt(self, data: bytes) -> bytes:
+        return self._fernet.encrypt(data).encode()
+    
+    def decrypt(self, token: bytes) -> bytes:
+        try:
+            return self._fernet.decrypt(token.decode())
+        except (rfernet.DecryptionError, UnicodeDecodeError):
+            raise InvalidToken
+
+# Every Fernet token starts with this (version byte plus a zero timestamp prefix);
+# the old double-encoded form never does
+FERNET_TOKEN_PREFIX = b"gAAAAA"
+
+# Tokens are interchangeable, so either implementation reads the other's data
+FernetImpl = _RustFernet if HAS_RFERNET else Fernet
+
 class EncryptionManager:
     def __init__(self, base_key: str = None):
         """Initialize encryption manager with base key"""
@@ -15,12 +63,45 @@ class EncryptionManager:
             base_key = os.environ.get('ENCRYPTION_KEY', 'default_key_change_me!')
         
         self.base_key = base_key.encode()
+        self._get_fernet = functools.lru_cache(maxsize=FERNET_CACHE_SIZE)(self._build_fernet)
+        self._get_legacy_fernet = functools.lru_cache(maxsize=FERNET_CACHE_SIZE)(self._build_legacy_fernet)
+        self._get_aead = functools.lru_cache(maxsize=FERNET_CACHE_SIZE)(self._build_aead)
     
     def _generate_user_key(self, user_id: int) -> bytes:
-        """Generate a unique encryption key for each user"""
+        """Generate a unique encryption key for each user.
+        
+        The base key is a high-entropy secret from the environment, not a
+        guessable password, so key stretching adds no security: a single HKDF
+        expansion gives an equally strong per-user key.
+        """
         # Combine base key with user ID for unique key per user
         salt = f"telegram_ssh_{user_id}".encode()
         
+        kdf = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            info=b"telegram_ssh",
+        )
+        key = base64.urlsafe_b64encode(kdf.derive(self.base_key))
+        return key
+    
+    def _generate_aead_key(self, user_id: int) -> bytes:
+        """Generate the raw AES-256-GCM key for a user (separate HKDF info from the Fernet key)"""
+        salt = f"telegram_ssh_{user_id}".encode()
+        
+        kdf = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            info=b"telegram_ssh_aesgcm",
+        )
+        return kdf.derive(self.base_key)
+    
+    def _generate_legacy_user_key(self, user_id: int) -> bytes:
+        """Generate the PBKDF2 key that data encrypted by older versions uses"""
+        salt = f"telegram_ssh_{user_id}".encode()
+        
         kdf = PBKDF2HMAC(
             algorithm=hashes.SHA256(),
             length=32,
@@ -30,15 +111,27 @@ class EncryptionManager:
         key = base64.urlsafe_b64encode(kdf.derive(self.base_key))
         return key
     
+    def _build_fernet(self, user_id: int) -> FernetImpl:
+        """Build the Fernet for a user (cached per instance as _get_fernet)"""
+        return FernetImpl(self._generate_user_key(user_id))
+    
+    def _build_legacy_fernet(self, user_id: int) -> FernetImpl:
+        """Build the pre-HKDF Fernet for a user (cached per instance as _get_legacy_fernet)"""
+        return FernetImpl(self._generate_legacy_user_key(user_id))
+    
+    def _build_aead(self, user_id: int) -> AESGCM:
+        """Build the AES-GCM cipher for a user (cached per instance as _get_aead)"""
+        return AESGCM(self._generate_aead_key(user_id))
+    
     def encrypt(self, data: str, user_id: int) -> str:
         """Encrypt data for a specific user"""
         if not data:
             return None
         
-        user_key = self._generate_user_key(user_id)
-        fernet = Fernet(user_key)
-        encrypted = fernet.encrypt(data.encode())
-        return base64.urlsafe_b64encode(encrypted).decode()
+        # One AES-NI/PCLMULQDQ pass, no separate HMAC as with Fernet
+        nonce = os.urandom(AESGCM_NONCE_SIZE)
+        encrypted = nonce + self._get_aead(user_id).encrypt(nonce, data.encode(), None)
+        return AESGCM_PREFIX + base64.urlsafe_b64encode(encrypted).decode('ascii')
     
     def decrypt(self, encrypted_data: str, user_id: int) -> Optional[str]:
         """Decrypt data for a specific user"""
@@ -46,13 +139,25 @@ class EncryptionManager:
             return None
         
         try:
-            user_key = self._generate_user_key(user_id)
-            fernet = Fernet(user_key)
-            decoded = base64.urlsafe_b64decode(encrypted_data.encode())
-            decrypted = fernet.decrypt(decoded)
+            if encrypted_data.startswith(AESGCM_PREFIX):
+                decoded = base64.urlsafe_b64decode(encrypted_data[len(AESGCM_PREFIX):])
+                nonce, ciphertext = decoded[:AESGCM_NONCE_SIZE], decoded[AESGCM_NONCE_SIZE:]
+                return self._get_aead(user_id).decrypt(nonce, ciphertext, None).decode()
+            
+            # Fernet values written by earlier versions
+            decoded = encrypted_data.encode()
+            if not decoded.startswith(FERNET_TOKEN_PREFIX):
+                # Stored by older versions with an extra base64 layer
+                decoded = base64.urlsafe_b64decode(decoded)
+            try:
+                decrypted = self._get_fernet(user_id).decrypt(decoded)
+            except InvalidToken:
+                # Stored before the switch to HKDF
+                decrypted = self._get_legacy_fernet(user_id).decrypt(decoded)
             return decrypted.decode()
-        except Exception as e:
-            print(f"Decryption error: {e}")
+        except (InvalidToken, InvalidTag, ValueError):
+            # Wrong key, tampered or malformed value (bad base64/UTF-8 are ValueErrors)
+            logger.debug("Failed to decrypt value for user %s", user_id)
             return None
     
     def encrypt_ssh_key(self, key_content: str, user_id: int) -> str:
@@ -66,5 +171,5 @@ class EncryptionManager:
     
     @staticmethod
     def generate_session_id() -> str:
-        """Generate a random session ID"""
-        return base64.urlsafe_b64encode(os.urandom(32)).decode('utf-8')[:32]
\ No newline at end of file
+        """Generate a random session ID (32 urlsafe characters, 192 bits)"""
+        return secrets.token_urlsafe(24)
\ No newline at end of file
@@ -7,6 +7,7 @@ Helps configure the bot and test the database
 import os
 import sys
 import secrets
+import importlib.util
 from pathlib import Path
 
 def generate_encryption_key():
@@ -158,17 +159,18 @@ def install_dependencies():
     print("\n📦 Checking Dependencies")
     print("=" * 40)
     
-    try:
-        import telegram
-        import sqlalchemy
-        import cryptography
+    # Only look the packages up; importing them here would load the heavy
+    # stack twice (again in test_database)
+    missing = [name for name in ("telegram", "sqlalchemy", "cryptography")
+               if importlib.util.find_spec(name) is None]
+    if not missing:
         print("✅ All dependencies installed")
         return True
-    except ImportError as e:
-        print(f"❌ Missing dependency: {e}")
-        print("\nInstalling dependencies...")
-        os.system("pip install -r requirements.txt")
-        return True
+    
+    print(f"❌ Missing dependency: {', '.join(missing)}")
+    print("\nInstalling dependencies...")
+    os.system("pip install -r requirements.txt")
+    return True
 
 def main():
     """Main setup function"""
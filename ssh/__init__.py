@@ -3,5 +3,6 @@ SSH module for connection management
 """
 from .connections import ConnectionManager
 from .session_manager import EnhancedSSHManager
+from .pool import SSHSessionPool
 
-__all__ = ['ConnectionManager', 'EnhancedSSHManager']
\ No newline at end of file
+__all__ = ['ConnectionManager', 'EnhancedSSHManager', 'SSHSessionPool']
\ No newline at end of file
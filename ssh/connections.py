@@ -3,15 +3,18 @@ SSH connection management with database integration
 """
 import os
 import tempfile
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 from database import DatabaseManager, SSHConnection
 from security import EncryptionManager
+from .pool import SSHSessionPool
 
 class ConnectionManager:
-    def __init__(self, db: DatabaseManager, encryption: EncryptionManager):
+    def __init__(self, db: DatabaseManager, encryption: EncryptionManager,
+                 pool: Optional[SSHSessionPool] = None):
         """Initialize connection manager"""
         self.db = db
         self.encryption = encryption
+        self.pool = pool
     
     def add_connection(self, user_id: int, name: str, host: str, port: int, 
                       username: str, auth_type: str, password: str = None, 
@@ -45,7 +48,7 @@ class ConnectionManager:
     
     def get_connection_credentials(self, user_id: int, connection_name: str) -> Optional[dict]:
         """Get decrypted connection credentials"""
-        connection = self.db.get_connection(user_id, connection_name)
+        connection = self.db.get_connection_with_credentials(user_id, connection_name)
         if not connection:
             return None
         
@@ -68,9 +71,10 @@ class ConnectionManager:
         
         return result
     
-    def prepare_ssh_key(self, user_id: int, connection_name: str) -> Optional[str]:
+    def prepare_ssh_key(self, user_id: int, connection_name: str, credentials: dict = None) -> Optional[str]:
         """Prepare SSH key for use (write to temporary file)"""
-        credentials = self.get_connection_credentials(user_id, connection_name)
+        if credentials is None:
+            credentials = self.get_connection_credentials(user_id, connection_name)
         if not credentials or credentials['auth_type'] != 'key':
             return None
         
@@ -78,32 +82,44 @@ class ConnectionManager:
         if not private_key:
             return None
         
-        # Create temporary file for SSH key
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.pem', delete=False) as f:
-            f.write(private_key)
-            f.flush()
-            os.chmod(f.name, 0o600)  # Set proper permissions
-            return f.name
+        # Create temporary file for SSH key; mkstemp opens it O_EXCL with mode 0600,
+        # so there's no window where the key is readable by others
+        fd, path = tempfile.mkstemp(suffix='.pem')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(private_key.encode())
+        return path
     
-    def format_ssh_command(self, user_id: int, connection_name: str) -> Optional[Tuple[str, Optional[str]]]:
-        """Format SSH command with credentials"""
-        credentials = self.get_connection_credentials(user_id, connection_name)
+    def format_ssh_command(self, user_id: int, connection_name: str,
+                           credentials: dict = None) -> Tuple[Optional[List[str]], Optional[str]]:
+        """Format SSH argv with credentials (pass already decrypted ones to skip the lookup).
+        
+        Returned as an argument list so names, hosts and paths are never re-split
+        or interpreted on the way to exec.
+        """
+        if credentials is None:
+            credentials = self.get_connection_credentials(user_id, connection_name)
         if not credentials:
             return None, None
         
         # Force pseudo-terminal allocation and send TERM env for proper TUI support
-        base_cmd = f"ssh -tt -o StrictHostKeyChecking=accept-new -o ServerAliveInterval=60 -o SendEnv=TERM"
+        base_cmd = ["ssh", "-tt", "-o", "StrictHostKeyChecking=accept-new", "-o", "SendEnv=TERM"]
+        if self.pool:
+            # Reuse an already authenticated transport to this host when one is up
+            key = (user_id, credentials['host'], credentials['port'], credentials['username'])
+            base_cmd += self.pool.ssh_options(key)
+        else:
+            base_cmd += ["-o", "ServerAliveInterval=60"]
+        # "--" keeps a destination starting with "-" from being read as an option
+        target = ["-p", str(credentials['port']), "--", f"{credentials['username']}@{credentials['host']}"]
         
         if credentials['auth_type'] == 'key':
             # Prepare key file
-            key_file = self.prepare_ssh_key(user_id, connection_name)
+            key_file = self.prepare_ssh_key(user_id, connection_name, credentials)
             if key_file:
-                cmd = f"{base_cmd} -i {key_file} -p {credentials['port']} {credentials['username']}@{credentials['host']}"
-                return cmd, key_file
+                return base_cmd + ["-i", key_file] + target, key_file
         else:
             # Password authentication
-            cmd = f"{base_cmd} -p {credentials['port']} {credentials['username']}@{credentials['host']}"
-            return cmd, None
+            return base_cmd + target, None
         
         return None, None
     
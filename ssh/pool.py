@@ -0,0 +1,76 @@
+"""
+SSH connection pool built on OpenSSH connection multiplexing
+"""
+import atexit
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from typing import List, Set, Tuple
+
+# (user_id, host, port, username)
+PoolKey = Tuple[int, str, int, str]
+
+
+class SSHSessionPool:
+    """Share one authenticated SSH transport per (user, host, port, username).
+
+    The first session to a host becomes the ControlMaster; later sessions open
+    a new channel on its socket and skip the TCP handshake, key exchange and
+    auth. Closing a session only releases its channel — the master lingers for
+    `persist_seconds` and is dropped by the keepalive if the network goes away.
+    """
+
+    def __init__(self, persist_seconds: int = 600, keepalive_interval: int = 30):
+        """Initialize the pool with a private socket directory"""
+        self.persist_seconds = persist_seconds
+        self.keepalive_interval = keepalive_interval
+        self.control_dir = tempfile.mkdtemp(prefix='tgssh-')  # mode 0700
+        self._keys: Set[PoolKey] = set()
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def control_path(self, key: PoolKey) -> str:
+        """Socket path for a pool key (hashed to stay under the sun_path limit)"""
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        return os.path.join(self.control_dir, digest)
+
+    def ssh_options(self, key: PoolKey) -> List[str]:
+        """ssh -o arguments that attach a session to the pooled transport"""
+        with self._lock:
+            self._keys.add(key)
+        return [
+            "-o", "ControlMaster=auto", "-o", f"ControlPath={self.control_path(key)}",
+            "-o", f"ControlPersist={self.persist_seconds}",
+            "-o", f"ServerAliveInterval={self.keepalive_interval}", "-o", "ServerAliveCountMax=3",
+        ]
+
+    def has_transport(self, key: PoolKey) -> bool:
+        """Check whether a master connection is currently up for this key"""
+        return os.path.exists(self.control_path(key))
+
+    def evict(self, key: PoolKey):
+        """Tear down the pooled transport for a key"""
+        _, host, port, username = key
+        path = self.control_path(key)
+        with self._lock:
+            self._keys.discard(key)
+        if not os.path.exists(path):
+            return
+        try:
+            subprocess.run(
+                ['ssh', '-o', f'ControlPath={path}', '-O', 'exit', '-p', str(port), f'{username}@{host}'],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=5
+            )
+        except Exception:
+            pass
+
+    def close(self):
+        """Close every pooled transport and remove the socket directory"""
+        with self._lock:
+            keys = list(self._keys)
+        for key in keys:
+            self.evict(key)
+        shutil.rmtree(self.control_dir, ignore_errors=True)
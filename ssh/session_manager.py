@@ -2,6 +2,7 @@
 Enhanced SSH session manager with database integration
 """
 import os
+import re
 import asyncio
 from typing import Dict, Optional
 from dataclasses import dataclass, field
@@ -9,19 +10,36 @@ import pexpect
 from database import DatabaseManager
 from security import EncryptionManager
 from .connections import ConnectionManager
+from .pool import SSHSessionPool
 
-@dataclass
+# Every login prompt in one compiled alternation, so each incoming chunk is
+# searched once; the matching group tells them apart
+LOGIN_PROMPT_RE = re.compile(
+    r"(password:)"  # Password prompt
+    r"|(passphrase)"  # SSH key passphrase
+    r"|([$#>])"  # Shell prompt ($, root #, or >)
+)
+SHELL_PROMPT_RE = re.compile(r"[$#>]")
+_LOGIN_PATTERNS = [LOGIN_PROMPT_RE, pexpect.EOF, pexpect.TIMEOUT]
+_SHELL_PATTERNS = [SHELL_PROMPT_RE]
+
+# Results of EnhancedSSHManager._wait_for_login_prompt
+PROMPT_PASSWORD, PROMPT_PASSPHRASE, PROMPT_SHELL, PROMPT_EOF, PROMPT_TIMEOUT = range(5)
+
+@dataclass(slots=True)  # One per active chat; no per-instance __dict__
 class SSHSession:
     child: pexpect.spawn
     host: str
     port: int
     username: str
     connection_id: Optional[int] = None
+    connection_name: Optional[str] = None  # Saved connection name, for display
     session_id: Optional[str] = None  # Database session ID
-    buffer: str = ""
     task: Optional[asyncio.Task] = None
     connected: bool = False
     temp_key_file: Optional[str] = None  # For cleaning up temp SSH keys
+    tui_warning_shown: bool = False  # Web terminal tip already sent for this session
+    markdown_ok: bool = True  # Cleared once output fails to parse as Markdown
     
     def send(self, data: str):
         self.child.send(data)
@@ -38,12 +56,22 @@ class SSHSession:
                 pass
 
 class EnhancedSSHManager:
-    def __init__(self, db: DatabaseManager, encryption: EncryptionManager):
+    def __init__(self, db: DatabaseManager, encryption: EncryptionManager,
+                 pool: Optional[SSHSessionPool] = None):
         """Initialize enhanced SSH manager"""
         self.sessions: Dict[int, SSHSession] = {}
         self.db = db
         self.encryption = encryption
-        self.connection_mgr = ConnectionManager(db, encryption)
+        self.pool = pool
+        self.connection_mgr = ConnectionManager(db, encryption, pool)
+    
+    @staticmethod
+    def _wait_for_login_prompt(child: pexpect.spawn, timeout: int = 10) -> int:
+        """Wait for the first prompt after spawning ssh (one of the PROMPT_* values)"""
+        index = child.expect_list(_LOGIN_PATTERNS, timeout=timeout)
+        if index == 0:
+            return child.match.lastindex - 1  # Group 1-3 -> PROMPT_PASSWORD..PROMPT_SHELL
+        return PROMPT_EOF if index == 1 else PROMPT_TIMEOUT
     
     def get(self, chat_id: int) -> Optional[SSHSession]:
         """Get session for a chat"""
@@ -54,13 +82,14 @@ class EnhancedSSHManager:
         if chat_id in self.sessions and self.sessions[chat_id].is_alive():
             raise RuntimeError("An SSH session is already active. Use /disconnect to close it.")
         
-        # Get connection details
-        connection = self.db.get_connection(user_id, connection_name)
-        if not connection:
+        # Fetch the connection and decrypt its credentials once; the command,
+        # key file, login and session record all use this one lookup
+        credentials = self.connection_mgr.get_connection_credentials(user_id, connection_name)
+        if not credentials:
             raise RuntimeError(f"Connection '{connection_name}' not found")
         
         # Get SSH command
-        ssh_cmd, temp_key_file = self.connection_mgr.format_ssh_command(user_id, connection_name)
+        ssh_cmd, temp_key_file = self.connection_mgr.format_ssh_command(user_id, connection_name, credentials)
         if not ssh_cmd:
             raise RuntimeError("Failed to prepare SSH command")
         
@@ -72,65 +101,55 @@ class EnhancedSSHManager:
         env['COLUMNS'] = '80'
 
         # Spawn with dimensions specified
-        child = pexpect.spawn(ssh_cmd, encoding="utf-8", timeout=30, env=env,
+        child = pexpect.spawn(ssh_cmd[0], ssh_cmd[1:], encoding="utf-8", timeout=30, env=env,
                               dimensions=(24, 80))  # rows, columns
         sess = SSHSession(
             child=child,
-            host=connection.host,
-            port=connection.port,
-            username=connection.username,
-            connection_id=connection.id,
+            host=credentials['host'],
+            port=credentials['port'],
+            username=credentials['username'],
+            connection_id=credentials['id'],
+            connection_name=credentials['name'],
             temp_key_file=temp_key_file
         )
         self.sessions[chat_id] = sess
         
-        # Get credentials for authentication
-        credentials = self.connection_mgr.get_connection_credentials(user_id, connection_name)
-        
         # Handle initial connection
         try:
-            index = child.expect([
-                "password:",  # Password prompt
-                "passphrase",  # SSH key passphrase
-                r"\$",  # Shell prompt (successful key auth)
-                r"#",   # Root shell prompt
-                r">",   # Another possible prompt
-                pexpect.EOF,
-                pexpect.TIMEOUT
-            ], timeout=10)
+            index = self._wait_for_login_prompt(child)
             
-            if index == 0:  # Password needed
+            if index == PROMPT_PASSWORD:
                 if credentials['auth_type'] == 'password' and credentials.get('password'):
                     child.sendline(credentials['password'])
                     # Wait for prompt after password
-                    child.expect([r"\$", r"#", r">"], timeout=10)
+                    child.expect_list(_SHELL_PATTERNS, timeout=10)
                     sess.connected = True
                 else:
                     sess.connected = False
-            elif index == 1:  # Key passphrase needed
+            elif index == PROMPT_PASSPHRASE:
                 if credentials.get('key_passphrase'):
                     child.sendline(credentials['key_passphrase'])
-                    child.expect([r"\$", r"#", r">"], timeout=10)
+                    child.expect_list(_SHELL_PATTERNS, timeout=10)
                     sess.connected = True
                 else:
                     sess.connected = False
-            elif index in [2, 3, 4]:  # Connected successfully
+            elif index == PROMPT_SHELL:  # Connected successfully
                 sess.connected = True
             else:
                 raise RuntimeError("SSH connection failed or timed out")
             
-            # Update last used timestamp
+            # Update last used timestamp and create the active session in one transaction
             if sess.connected:
-                self.db.update_connection_last_used(connection.id)
-                
-                # Create active session in database
                 session_id = self.encryption.generate_session_id()
                 sess.session_id = session_id
-                self.db.create_session(user_id, session_id, connection.id, chat_id)
+                self.db.finalize_connect(credentials['id'], user_id, session_id, chat_id)
                 
         except Exception as e:
             sess.cleanup()
             self.sessions.pop(chat_id, None)
+            if self.pool:
+                # Don't hand a broken transport to the next attempt
+                self.pool.evict((user_id, credentials['host'], credentials['port'], credentials['username']))
             raise RuntimeError(f"Connection failed: {str(e)}")
         
         return sess
@@ -140,27 +159,20 @@ class EnhancedSSHManager:
         if chat_id in self.sessions and self.sessions[chat_id].is_alive():
             raise RuntimeError("An SSH session is already active. Use /disconnect to close it.")
         
-        ssh_cmd = f"ssh -o StrictHostKeyChecking=accept-new -o ServerAliveInterval=60 -p {port} {username}@{host}"
+        ssh_args = ["-o", "StrictHostKeyChecking=accept-new", "-o", "ServerAliveInterval=60",
+                    "-p", str(port), "--", f"{username}@{host}"]
         
-        child = pexpect.spawn(ssh_cmd, encoding="utf-8", timeout=30)
+        child = pexpect.spawn("ssh", ssh_args, encoding="utf-8", timeout=30)
         sess = SSHSession(child=child, host=host, port=port, username=username)
         self.sessions[chat_id] = sess
         
         # Handle initial connection
         try:
-            index = child.expect([
-                "password:",  # Password prompt
-                "passphrase",  # SSH key passphrase
-                r"\$",  # Shell prompt
-                r"#",   # Root shell prompt
-                r">",   # Another prompt
-                pexpect.EOF,
-                pexpect.TIMEOUT
-            ], timeout=10)
+            index = self._wait_for_login_prompt(child)
             
-            if index in [0, 1]:  # Auth needed
+            if index in (PROMPT_PASSWORD, PROMPT_PASSPHRASE):  # Auth needed
                 sess.connected = False
-            elif index in [2, 3, 4]:  # Connected
+            elif index == PROMPT_SHELL:  # Connected
                 sess.connected = True
             else:
                 raise RuntimeError("SSH connection failed or timed out")
@@ -182,6 +194,7 @@ class EnhancedSSHManager:
         if sess.task:
             sess.task.cancel()
         
+        # Only this session's channel goes away; a pooled transport stays up
         sess.child.terminate()
         sess.cleanup()  # Clean up temp files
         
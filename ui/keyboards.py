@@ -1,11 +1,41 @@
 """
 Inline keyboard builders for the bot
 """
+from functools import lru_cache
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
+
+# Buttons shared by the per-connection keyboards, built once at import
+# (buttons are immutable, so one object can sit in any number of markups)
+_BACK_TO_MAIN_ROW = (InlineKeyboardButton("⬅️ Back", callback_data="menu_main"),)
+_BACK_TO_LIST_ROW = (InlineKeyboardButton("⬅️ Back", callback_data="menu_list"),)
+_CANCEL_TO_LIST = InlineKeyboardButton("❌ Cancel", callback_data="menu_list")
+
+class _SerializedMarkup(InlineKeyboardMarkup):
+    """InlineKeyboardMarkup that builds its request dict once.
+    
+    Only for the keyboards cached below: they are frozen and reused for every
+    send, so the button tree doesn't need walking again each time.
+    """
+    
+    __slots__ = ('_serialized',)
+    
+    def to_dict(self, recursive: bool = True) -> Dict[str, Any]:
+        if not recursive:
+            return super().to_dict(recursive)
+        serialized = getattr(self, '_serialized', None)
+        if serialized is None:
+            serialized = self._serialized = super().to_dict()
+        return dict(serialized)  # Shallow copy; callers may add or pop keys
 
 class KeyboardBuilder:
+    # Keyboards without arguments never change, so they are built once and the
+    # same (immutable) markup object is reused. Per-connection ones depend only
+    # on the name and are kept in a bounded cache. Lists are assembled per call
+    # from cached per-connection buttons
+    
     @staticmethod
+    @lru_cache(maxsize=None)
     def main_menu() -> InlineKeyboardMarkup:
         """Build main menu keyboard"""
         keyboard = [
@@ -22,37 +52,42 @@ class KeyboardBuilder:
                 InlineKeyboardButton("❓ Help", callback_data="menu_help"),
             ]
         ]
-        return InlineKeyboardMarkup(keyboard)
+        return _SerializedMarkup(keyboard)
+    
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _connection_button(prefix: str, conn_id: int, name: str, is_default: bool,
+                           username: str, host: str, port: int) -> InlineKeyboardButton:
+        """Build (once per distinct connection row) the button for one connection"""
+        # Show default marker
+        if is_default:
+            name = f"⭐ {name}"
+        
+        # Format connection info
+        info = f"{username}@{host}:{port}"
+        
+        return InlineKeyboardButton(f"{name} ({info})", callback_data=f"{prefix}:{conn_id}")
     
     @staticmethod
     def connections_list(connections: List[dict], prefix: str = "connect") -> InlineKeyboardMarkup:
         """Build connections list keyboard"""
-        keyboard = []
-        
-        for conn in connections:
-            # Show default marker
-            name = conn['name']
-            if conn.get('is_default'):
-                name = f"⭐ {name}"
-            
-            # Format connection info
-            info = f"{conn['username']}@{conn['host']}:{conn['port']}"
-            
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"{name} ({info})",
-                    callback_data=f"{prefix}:{conn['id']}"
-                )
-            ])
+        # Sized up front (one row per connection plus the back row) and filled by index
+        n = len(connections)
+        keyboard = [None] * (n + 1)
+        button = KeyboardBuilder._connection_button
+        for i, conn in enumerate(connections):
+            keyboard[i] = (button(
+                prefix, conn['id'], conn['name'], bool(conn['is_default']),
+                conn['username'], conn['host'], conn['port']
+            ),)
         
         # Add back button
-        keyboard.append([
-            InlineKeyboardButton("⬅️ Back", callback_data="menu_main")
-        ])
+        keyboard[n] = _BACK_TO_MAIN_ROW
         
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
+    @lru_cache(maxsize=256)
     def connection_actions(connection_name: str) -> InlineKeyboardMarkup:
         """Build connection actions keyboard"""
         keyboard = [
@@ -64,13 +99,22 @@ class KeyboardBuilder:
                 InlineKeyboardButton("⭐ Set as Default", callback_data=f"set_default:{connection_name}"),
                 InlineKeyboardButton("🗑️ Delete", callback_data=f"delete_conn:{connection_name}"),
             ],
-            [
-                InlineKeyboardButton("⬅️ Back", callback_data="menu_list")
-            ]
+            _BACK_TO_LIST_ROW
         ]
-        return InlineKeyboardMarkup(keyboard)
+        return _SerializedMarkup(keyboard)
+    
+    @staticmethod
+    def forget_connections():
+        """Drop the cached per-connection keyboards (after a connection is deleted).
+        
+        lru_cache can't evict a single name, but rebuilding the rest is cheap
+        """
+        KeyboardBuilder._connection_button.cache_clear()
+        KeyboardBuilder.connection_actions.cache_clear()
+        KeyboardBuilder.confirm_delete.cache_clear()
     
     @staticmethod
+    @lru_cache(maxsize=None)
     def auth_type_selection() -> InlineKeyboardMarkup:
         """Build auth type selection keyboard"""
         keyboard = [
@@ -82,20 +126,22 @@ class KeyboardBuilder:
                 InlineKeyboardButton("❌ Cancel", callback_data="cancel_add")
             ]
         ]
-        return InlineKeyboardMarkup(keyboard)
+        return _SerializedMarkup(keyboard)
     
     @staticmethod
+    @lru_cache(maxsize=256)
     def confirm_delete(connection_name: str) -> InlineKeyboardMarkup:
         """Build delete confirmation keyboard"""
         keyboard = [
             [
                 InlineKeyboardButton("✅ Yes, Delete", callback_data=f"confirm_delete:{connection_name}"),
-                InlineKeyboardButton("❌ Cancel", callback_data="menu_list"),
+                _CANCEL_TO_LIST,
             ]
         ]
-        return InlineKeyboardMarkup(keyboard)
+        return _SerializedMarkup(keyboard)
     
     @staticmethod
+    @lru_cache(maxsize=None)
     def session_actions() -> InlineKeyboardMarkup:
         """Build session actions keyboard for active connection"""
         keyboard = [
@@ -112,15 +158,17 @@ class KeyboardBuilder:
                 InlineKeyboardButton("🌐 Web Terminal", callback_data="session_webapp"),
             ]
         ]
-        return InlineKeyboardMarkup(keyboard)
+        return _SerializedMarkup(keyboard)
     
     @staticmethod
+    @lru_cache(maxsize=None)
     def cancel_only() -> InlineKeyboardMarkup:
         """Build cancel-only keyboard"""
         keyboard = [[InlineKeyboardButton("❌ Cancel", callback_data="cancel_operation")]]
-        return InlineKeyboardMarkup(keyboard)
+        return _SerializedMarkup(keyboard)
     
     @staticmethod
+    @lru_cache(maxsize=None)
     def tui_navigation() -> InlineKeyboardMarkup:
         """Build TUI navigation keyboard"""
         keyboard = [
@@ -154,9 +202,10 @@ class KeyboardBuilder:
                 InlineKeyboardButton("🌐 Web Terminal", callback_data="webapp:launch"),
             ]
         ]
-        return InlineKeyboardMarkup(keyboard)
+        return _SerializedMarkup(keyboard)
     
     @staticmethod
+    @lru_cache(maxsize=None)
     def tui_ctrl() -> InlineKeyboardMarkup:
         """Build Ctrl key combinations keyboard"""
         keyboard = [
@@ -184,9 +233,10 @@ class KeyboardBuilder:
                 InlineKeyboardButton("🔙 Back", callback_data="kbd:navigation"),
             ]
         ]
-        return InlineKeyboardMarkup(keyboard)
+        return _SerializedMarkup(keyboard)
     
     @staticmethod
+    @lru_cache(maxsize=None)
     def tui_special() -> InlineKeyboardMarkup:
         """Build special keys keyboard"""
         keyboard = [
@@ -206,9 +256,10 @@ class KeyboardBuilder:
                 InlineKeyboardButton("🌐 Web Terminal", callback_data="webapp:launch"),
             ]
         ]
-        return InlineKeyboardMarkup(keyboard)
+        return _SerializedMarkup(keyboard)
     
     @staticmethod
+    @lru_cache(maxsize=None)
     def tui_function() -> InlineKeyboardMarkup:
         """Build function keys keyboard"""
         keyboard = [
@@ -234,4 +285,4 @@ class KeyboardBuilder:
                 InlineKeyboardButton("🔙 Back", callback_data="kbd:navigation"),
             ]
         ]
-        return InlineKeyboardMarkup(keyboard)
\ No newline at end of file
+        return _SerializedMarkup(keyboard)
\ No newline at end of file
@@ -1,7 +1,9 @@
 """
 Conversation wizards for multi-step processes
 """
-from telegram import Update
+from typing import Optional
+from telegram import Message, Update
+from telegram.error import TelegramError
 from telegram.ext import (
     ConversationHandler,
     CommandHandler,
@@ -13,16 +15,29 @@ from telegram.ext import (
 from database import DatabaseManager
 from security import EncryptionManager
 from ssh import ConnectionManager
+from .keyboards import KeyboardBuilder
 
 # Conversation states
 (NAME, HOST, PORT, USERNAME, AUTH_TYPE, 
  PASSWORD, SSH_KEY, KEY_PASSPHRASE, CONFIRM) = range(9)
 
+# Largest key file accepted (real private keys are a few KiB)
+SSH_KEY_MAX_SIZE = 64 * 1024
+
+async def _delete_quietly(message: Message):
+    """Delete a message holding a secret (failing, e.g. for lack of rights, is harmless)"""
+    try:
+        await message.delete()
+    except TelegramError:
+        pass
+
 class ConnectionWizard:
-    def __init__(self, db: DatabaseManager, encryption: EncryptionManager):
+    def __init__(self, db: DatabaseManager, encryption: EncryptionManager,
+                 connection_mgr: Optional[ConnectionManager] = None):
         self.db = db
         self.encryption = encryption
-        self.connection_mgr = ConnectionManager(db, encryption)
+        # Share the bot's manager when given rather than building a second one
+        self.connection_mgr = connection_mgr or ConnectionManager(db, encryption)
     
     async def start_add(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Start the add connection wizard"""
@@ -127,13 +142,10 @@ class ConnectionWizard:
         
         context.user_data['connection']['username'] = username
         
-        from ui.keyboards import KeyboardBuilder
-        keyboard = KeyboardBuilder.auth_type_selection()
-        
         await update.message.reply_text(
             f"Username: {username}\n\n"
             "Choose authentication type:",
-            reply_markup=keyboard
+            reply_markup=KeyboardBuilder.auth_type_selection()
         )
         
         return AUTH_TYPE
@@ -173,11 +185,9 @@ class ConnectionWizard:
         
         context.user_data['connection']['password'] = password
         
-        # Delete the password message for security
-        try:
-            await update.message.delete()
-        except:
-            pass
+        # Delete the password message for security (in the background, so the
+        # Telegram round trip doesn't hold up the reply)
+        context.application.create_task(_delete_quietly(update.message), update=update)
         
         await self.save_connection(update, context)
         return ConversationHandler.END
@@ -187,9 +197,19 @@ class ConnectionWizard:
         key_content = None
         
         # Check if it's a file
-        if update.message.document:
-            file = await update.message.document.get_file()
-            key_content = (await file.download_as_bytearray()).decode('utf-8')
+        document = update.message.document
+        if document:
+            # Refuse oversized uploads before downloading anything
+            if document.file_size and document.file_size > SSH_KEY_MAX_SIZE:
+                await update.message.reply_text("That file is too large to be an SSH key. Please send the key:")
+                return SSH_KEY
+            file = await document.get_file()
+            data = await file.download_as_bytearray()
+            try:
+                # Decoded straight from the downloaded buffer, no intermediate bytes copy
+                key_content = data.decode('utf-8') if len(data) <= SSH_KEY_MAX_SIZE else None
+            except UnicodeDecodeError:
+                key_content = None
         elif update.message.text:
             key_content = update.message.text
         
@@ -200,10 +220,7 @@ class ConnectionWizard:
         context.user_data['connection']['private_key'] = key_content
         
         # Delete the message with the key for security
-        try:
-            await update.message.delete()
-        except:
-            pass
+        context.application.create_task(_delete_quietly(update.message), update=update)
         
         await update.message.reply_text(
             "Key received.\n\n"
@@ -219,10 +236,7 @@ class ConnectionWizard:
         if text != '/skip':
             context.user_data['connection']['key_passphrase'] = text
             # Delete the passphrase message for security
-            try:
-                await update.message.delete()
-            except:
-                pass
+            context.application.create_task(_delete_quietly(update.message), update=update)
         
         await self.save_connection(update, context)
         return ConversationHandler.END
@@ -5,18 +5,18 @@ Properly handles PTY creation and data flow
 """
 
 import asyncio
+import io
 import json
 import os
 import sys
 import pty
-import select
 import struct
 import fcntl
 import termios
 import signal
-import subprocess
 import tempfile
-from typing import Dict, Optional
+from collections import deque
+from typing import Dict, Optional, Tuple
 from dataclasses import dataclass
 from pathlib import Path
 
@@ -28,24 +28,62 @@ from starlette.requests import Request
 import uvicorn
 import logging
 
+try:
+    import orjson  # C JSON parser for the text control frames
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 # Add parent directory to path to import shared modules
 sys.path.insert(0, str(Path(__file__).parent.parent))
 from database import DatabaseManager
 from security import EncryptionManager
+from ssh import SSHSessionPool
 import config
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+# Setup logging (per-session and per-frame details are debug level, off unless DEBUG)
+logging.basicConfig(level=logging.INFO if not config.DEBUG else logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 # Configuration
 AUTHORIZED_USER_IDS = {289310951}  # Same as main bot
 DEFAULT_SHELL = os.environ.get("SHELL", "/bin/bash")
 DEFAULT_CWD = os.getcwd()
+# Environment for spawned shells and ssh, built once rather than per session
+# (the spawn only reads it, never changes it)
+PTY_ENV = {**os.environ, "TERM": "xterm-256color"}
+# PTY reads queued for the WebSocket before the fd stops being watched
+PTY_QUEUE_SIZE = 64
+# Bytes per PTY read (a full-screen TUI redraw is tens of KiB), and the most one
+# readiness callback drains before yielding back to the event loop
+PTY_READ_SIZE = 65536
+PTY_DRAIN_LIMIT = 256 * 1024
+# Reads at least this big look like a burst (cat, a redraw), so the sender waits
+# a few ms for the rest and sends it as one frame; smaller ones (echo) go at once
+PTY_COALESCE_MIN = 512
+PTY_COALESCE_DELAY = 0.003
+# Coalescing stops once a frame holds this much; the rest goes in the next one
+PTY_FRAME_LIMIT = 256 * 1024
+
+# Binary client frames start with a one-byte tag: input is followed by the raw
+# bytes for the PTY, resize by rows and cols as little-endian uint16s
+FRAME_INPUT = 0x01
+FRAME_RESIZE = 0x02
+RESIZE_FRAME = struct.Struct('<HH')
+# Fixed error replies, serialized once
+SESSION_NOT_FOUND = json.dumps({"error": "Session not found"})
+CONNECTION_NOT_FOUND = json.dumps({"error": "Connection not found"})
+
+# Client input chunks queued for the PTY before the receive loop waits
+PTY_INPUT_QUEUE_SIZE = 256
+# struct winsize for TIOCSWINSZ: rows, cols, xpixel, ypixel
+WINSIZE = struct.Struct('HHHH')
 
 # Initialize database and encryption
 db = DatabaseManager(config.DATABASE_URL)
 encryption = EncryptionManager(config.ENCRYPTION_KEY)
+# Sessions to a host the user is already connected to multiplex over that transport
+ssh_pool = SSHSessionPool(config.SSH_CONTROL_PERSIST) if config.SSH_CONTROL_PERSIST > 0 else None
 
 app = FastAPI()
 
@@ -68,19 +106,171 @@ except Exception as e:
     logger.error(f"Failed to mount static files: {e}")
 
 # Track active sessions
-@dataclass
+@dataclass(slots=True)
 class TerminalSession:
-    process: Optional[subprocess.Popen] = None
+    process: Optional[asyncio.subprocess.Process] = None
     master_fd: Optional[int] = None
     websocket: Optional[WebSocket] = None
     read_task: Optional[asyncio.Task] = None
+    write_task: Optional[asyncio.Task] = None
     session_id: Optional[str] = None
     connection_id: Optional[int] = None
     temp_key_file: Optional[str] = None
+    last_size: Optional[Tuple[int, int]] = None  # (rows, cols) last applied to the PTY
 
 sessions: Dict[str, TerminalSession] = {}
 
 
+async def pump_pty_output(master_fd: int, websocket: WebSocket):
+    """Forward PTY output to the WebSocket until the child side closes.
+    
+    The event loop watches master_fd and calls back as soon as it is readable,
+    so there is no polling delay and an idle session doesn't wake up at all.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=PTY_QUEUE_SIZE)
+    paused = False
+    # Reads land in one buffer reused for the whole session, so a wakeup costs a
+    # single bytes copy instead of a new object per read plus a join
+    buffer = memoryview(bytearray(PTY_DRAIN_LIMIT))
+    pty_file = io.FileIO(master_fd, 'rb', closefd=False)
+    
+    def on_readable():
+        nonlocal paused
+        # Drain what's already buffered so a full redraw goes out as one frame.
+        # An EOF right after data shows up again on the next callback
+        size = 0
+        while size < PTY_DRAIN_LIMIT:
+            try:
+                n = pty_file.readinto(buffer[size:size + PTY_READ_SIZE])
+            except OSError:  # EIO: the process exited and the slave side is gone
+                n = 0
+            if n is None:  # Nothing more to read right now
+                if not size:
+                    return
+                break
+            if not n:
+                break
+            size += n
+        output = bytes(buffer[:size])
+        queue.put_nowait(output)
+        if not output or queue.full():
+            # EOF, or the sender is behind: stop watching until there's room again
+            # (meanwhile the PTY buffer fills and throttles the process)
+            loop.remove_reader(master_fd)
+            paused = bool(output)
+    
+    loop.add_reader(master_fd, on_readable)
+    try:
+        eof = False
+        while not eof:
+            output = await queue.get()
+            if not output:
+                break
+            if len(output) >= PTY_COALESCE_MIN:
+                await asyncio.sleep(PTY_COALESCE_DELAY)
+            # Take what was read in the meantime, up to the frame limit
+            if not queue.empty():
+                chunks = [output]
+                size = len(output)
+                while size < PTY_FRAME_LIMIT and not queue.empty():
+                    chunk = queue.get_nowait()
+                    if not chunk:
+                        eof = True
+                        break
+                    chunks.append(chunk)
+                    size += len(chunk)
+                output = b''.join(chunks)
+            # The reader only watches while there's room for what it reads
+            if paused and not queue.full():
+                paused = False
+                loop.add_reader(master_fd, on_readable)
+            # Raw bytes in a binary frame; the browser decodes them (natively and
+            # statefully, so characters split across frames survive)
+            await websocket.send_bytes(output)
+    finally:
+        loop.remove_reader(master_fd)
+
+
+async def pump_pty_input(master_fd: int, queue: asyncio.Queue):
+    """Write queued client input to the PTY until cancelled.
+    
+    Whatever queued up meanwhile goes out in one writev, without joining the
+    chunks first. When the PTY buffer is full (a big paste into a busy program)
+    this waits for the fd to become writable, rather than the receive loop
+    hitting EAGAIN or losing the part of a short write that didn't fit.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        chunks = deque([await queue.get()])
+        while not queue.empty():  # Never more than the queue size, well under IOV_MAX
+            chunks.append(queue.get_nowait())
+        while chunks:
+            try:
+                written = os.writev(master_fd, chunks)
+            except BlockingIOError:
+                writable = loop.create_future()
+                loop.add_writer(master_fd, lambda: writable.done() or writable.set_result(None))
+                try:
+                    await writable
+                finally:
+                    loop.remove_writer(master_fd)
+                continue
+            # Drop what went out; a partly written chunk keeps its unwritten tail
+            while chunks and written >= len(chunks[0]):
+                written -= len(chunks.popleft())
+            if written:
+                chunks[0] = memoryview(chunks[0])[written:]
+
+
+async def stop_process(process: asyncio.subprocess.Process):
+    """Terminate the process, killing it if it hasn't exited within a second.
+    
+    Awaited rather than waited on, so a burst of disconnects is cleaned up
+    concurrently instead of each one stalling the event loop.
+    """
+    try:
+        process.terminate()
+        await asyncio.wait_for(process.wait(), timeout=1)
+    except ProcessLookupError:
+        pass  # Already gone
+    except asyncio.TimeoutError:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        await process.wait()
+
+
+def resize_pty(session: TerminalSession, rows: int, cols: int):
+    """Set the PTY window size and tell the process about it.
+    
+    Mobile clients send bursts of resizes while the keyboard slides in and out;
+    repeats of the current size are skipped (no ioctl, no SIGWINCH redraw).
+    """
+    if session.last_size == (rows, cols):
+        return
+    fcntl.ioctl(session.master_fd, termios.TIOCSWINSZ, WINSIZE.pack(rows, cols, 0, 0))
+    session.last_size = (rows, cols)
+    
+    # Send SIGWINCH to process
+    process = session.process
+    if process and process.pid:
+        try:
+            os.kill(process.pid, signal.SIGWINCH)
+        except ProcessLookupError:
+            logger.debug("Process %s not found for SIGWINCH", process.pid)
+
+
+async def receive_frame(websocket: WebSocket):
+    """Receive one frame: bytes for binary ones (terminal input), str for text (JSON control)"""
+    message = await websocket.receive()
+    if message['type'] == 'websocket.disconnect':
+        raise WebSocketDisconnect(message.get('code', 1000))
+    data = message.get('bytes')
+    return data if data is not None else message['text']
+
+
 @app.on_event("startup")
 async def startup_event():
     """Log startup information"""
@@ -88,6 +278,27 @@ async def startup_event():
     logger.info(f"Port: {os.environ.get('PORT', '8000')}")
     logger.info(f"Default Shell: {DEFAULT_SHELL}")
     logger.info(f"Templates configured: {templates is not None}")
+    # uvicorn's default loop="auto" picks uvloop when installed (uvicorn[standard])
+    loop = asyncio.get_running_loop()
+    logger.info(f"Event loop: {type(loop).__module__}")
+    
+    # Start tasks eagerly: ones that finish without blocking (most per-message
+    # work) then skip a trip through the loop. Python 3.12+ only
+    if hasattr(asyncio, "eager_task_factory"):
+        loop.set_task_factory(asyncio.eager_task_factory)
+
+    # On the stdlib loop, Python 3.11 watches each shell with a thread parked in
+    # waitpid(); a pidfd watcher delivers the exit as a loop event instead
+    # (uvloop reaps from SIGCHLD, and 3.12+ already defaults to pidfd)
+    if sys.version_info < (3, 12) and type(loop).__module__.startswith("asyncio"):
+        try:
+            os.close(os.pidfd_open(os.getpid()))
+        except (AttributeError, OSError):
+            pass  # Kernel older than 5.3
+        else:
+            watcher = asyncio.PidfdChildWatcher()
+            watcher.attach_loop(loop)
+            asyncio.set_child_watcher(watcher)
 
 
 @app.get("/health")
@@ -134,7 +345,7 @@ async def root(request: Request):
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
     """WebSocket endpoint for terminal communication"""
     await websocket.accept()
-    print(f"WebSocket connected for user {user_id}")
+    logger.info(f"WebSocket connected for user {user_id}")
     
     # Create session
     session = TerminalSession(websocket=websocket)
@@ -149,65 +360,43 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
         master_fd, slave_fd = pty.openpty()
         session.master_fd = master_fd
         
-        print(f"Created PTY: master={master_fd}, slave={slave_fd}")
+        logger.debug("Created PTY: master=%s, slave=%s", master_fd, slave_fd)
         
         # Make master non-blocking
-        flags = fcntl.fcntl(master_fd, fcntl.F_GETFL)
-        fcntl.fcntl(master_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        os.set_blocking(master_fd, False)
         
-        # Start shell process using subprocess.Popen for better control
-        process = subprocess.Popen(
-            [DEFAULT_SHELL],
+        # Start shell process (asyncio's, so waiting for it to exit doesn't block)
+        process = await asyncio.create_subprocess_exec(
+            DEFAULT_SHELL,
             stdin=slave_fd,
             stdout=slave_fd,
             stderr=slave_fd,
             cwd=DEFAULT_CWD,
-            preexec_fn=os.setsid,
-            env={**os.environ.copy(), "TERM": "xterm-256color"}
+            start_new_session=True,
+            env=PTY_ENV
         )
         session.process = process
         
-        print(f"Started shell process: PID={process.pid}")
+        logger.debug("Started shell process: PID=%s", process.pid)
         
         # IMPORTANT: Close slave FD in parent process after starting child
         os.close(slave_fd)
         slave_fd = None
-        print("Closed slave FD in parent")
         
         # Start output reader task
         async def read_output():
             """Read output from PTY and send to WebSocket"""
-            print("Starting output reader task")
-            loop = asyncio.get_event_loop()
-            
-            while process and process.poll() is None:  # While process is running
-                try:
-                    # Check if data is available to read
-                    r, _, _ = select.select([master_fd], [], [], 0.01)
-                    if r:
-                        try:
-                            # Read available data
-                            output = os.read(master_fd, 4096)
-                            if output:
-                                # Send to WebSocket as text
-                                text_output = output.decode('utf-8', errors='replace')
-                                print(f"Read output: {repr(text_output[:50])}...")
-                                await websocket.send_text(text_output)
-                        except OSError as e:
-                            if e.errno == 5:  # Input/output error - process might have exited
-                                break
-                            print(f"Read OSError: {e}")
-                    
-                except Exception as e:
-                    print(f"Read error: {e}")
-                    break
-                    
-                await asyncio.sleep(0.01)
-            
-            print("Output reader task ended")
+            logger.debug("Starting output reader task")
+            try:
+                await pump_pty_output(master_fd, websocket)
+            except Exception as e:
+                logger.warning(f"Read error: {e}")
+            logger.debug("Output reader task ended")
         
-        # Start the reader task
+        # Start the reader task, and the writer that feeds client input to the PTY
         session.read_task = asyncio.create_task(read_output())
+        input_queue = asyncio.Queue(maxsize=PTY_INPUT_QUEUE_SIZE)
+        session.write_task = asyncio.create_task(pump_pty_input(master_fd, input_queue))
         
         # Send initial prompt by sending a newline
         os.write(master_fd, b'\n')
@@ -215,15 +404,22 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
         # Handle incoming messages
         while True:
             try:
-                message = await websocket.receive_text()
-                data = json.loads(message)
+                frame = await receive_frame(websocket)
+                if isinstance(frame, bytes):
+                    # Keystrokes and resizes come as tagged binary frames, no JSON
+                    tag = frame[0] if frame else None
+                    if tag == FRAME_INPUT:
+                        await input_queue.put(memoryview(frame)[1:])
+                    elif tag == FRAME_RESIZE:
+                        rows, cols = RESIZE_FRAME.unpack_from(frame, 1)
+                        resize_pty(session, rows, cols)
+                    continue
+                data = json_loads(frame)
                 
                 if data['type'] == 'input':
                     # Write input to PTY
                     input_data = data['data']
-                    print(f"Received input: {repr(input_data)}")
-                    written = os.write(master_fd, input_data.encode())
-                    print(f"Wrote {written} bytes to PTY")
+                    await input_queue.put(input_data.encode())
                     
                 elif data['type'] == 'ping':
                     # Respond to heartbeat ping
@@ -233,52 +429,33 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
                     # Resize PTY
                     cols = data.get('cols', 80)
                     rows = data.get('rows', 24)
-                    print(f"Resizing to {cols}x{rows}")
-                    
-                    # Set terminal size
-                    winsize = struct.pack('HHHH', rows, cols, 0, 0)
-                    fcntl.ioctl(master_fd, termios.TIOCSWINSZ, winsize)
-                    
-                    # Send SIGWINCH to process
-                    if process and process.pid:
-                        try:
-                            os.kill(process.pid, signal.SIGWINCH)
-                        except ProcessLookupError:
-                            print(f"Process {process.pid} not found for SIGWINCH")
+                    resize_pty(session, rows, cols)
                         
             except WebSocketDisconnect:
-                print("WebSocket disconnected")
+                logger.info("WebSocket disconnected")
                 break
             except Exception as e:
-                print(f"WebSocket error: {e}")
+                logger.warning(f"WebSocket error: {e}")
                 break
                 
     except Exception as e:
-        print(f"Session error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Session error: {e}")
         
     finally:
-        print("Cleaning up session")
+        logger.debug("Cleaning up session")
         
-        # Cancel read task
-        if session.read_task:
-            session.read_task.cancel()
-            try:
-                await session.read_task
-            except asyncio.CancelledError:
-                pass
+        # Cancel the reader and writer tasks
+        for task in (session.read_task, session.write_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
         
         # Terminate process
         if process:
-            try:
-                process.terminate()
-                process.wait(timeout=1)
-            except:
-                try:
-                    process.kill()
-                except:
-                    pass
+            await stop_process(process)
         
         # Close file descriptors
         if master_fd is not None:
@@ -293,21 +470,22 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
             except:
                 pass
         
-        # Remove session
-        sessions.pop(user_id, None)
-        print(f"Session cleaned up for user {user_id}")
+        # Remove session, unless a reconnect has already registered its own
+        if sessions.get(user_id) is session:
+            del sessions[user_id]
+        logger.info(f"Session cleaned up for user {user_id}")
 
 
 @app.websocket("/ws/session/{session_id}")
 async def websocket_session_endpoint(websocket: WebSocket, session_id: str):
     """WebSocket endpoint for SSH sessions initiated from Telegram bot"""
     await websocket.accept()
-    print(f"WebSocket connected for session {session_id}")
+    logger.info(f"WebSocket connected for session {session_id}")
     
     # Get session details from database
     active_session = db.get_session_by_id(session_id)
     if not active_session:
-        await websocket.send_text(json.dumps({"error": "Session not found"}))
+        await websocket.send_text(SESSION_NOT_FOUND)
         await websocket.close()
         return
     
@@ -317,7 +495,7 @@ async def websocket_session_endpoint(websocket: WebSocket, session_id: str):
         connection = db.get_connection_by_id(connection_id=active_session.connection_id)
     
     if not connection:
-        await websocket.send_text(json.dumps({"error": "Connection not found"}))
+        await websocket.send_text(CONNECTION_NOT_FOUND)
         await websocket.close()
         return
     
@@ -343,55 +521,53 @@ async def websocket_session_endpoint(websocket: WebSocket, session_id: str):
         conn_mgr = ConnectionManager(db, encryption)
         credentials = conn_mgr.get_connection_credentials(active_session.user_id, connection.name)
         
-        print(f"Retrieved credentials for {connection.name}:")
-        print(f"  Auth type: {connection.auth_type}")
-        print(f"  Has password: {bool(credentials.get('password'))}")
-        if credentials.get('password'):
-            # Don't log actual password, just length
-            print(f"  Password length: {len(credentials['password'])}")
+        logger.debug("Retrieved credentials for %s (auth type %s, has password: %s)",
+                     connection.name, connection.auth_type, bool(credentials.get('password')))
         
         # Create SSH command - if password auth, use sshpass
         if connection.auth_type == 'password' and credentials.get('password'):
-            ssh_base_args, temp_key_file = create_ssh_command(connection, credentials)
+            ssh_base_args, temp_key_file = create_ssh_command(connection, credentials, ssh_pool,
+                                                              active_session.user_id)
             # Use sshpass to provide password
             ssh_args = ['sshpass', '-p', credentials['password']] + ssh_base_args
-            print(f"Using sshpass for password authentication")
         else:
-            ssh_args, temp_key_file = create_ssh_command(connection, credentials)
+            ssh_args, temp_key_file = create_ssh_command(connection, credentials, ssh_pool,
+                                                         active_session.user_id)
         session.temp_key_file = temp_key_file
         
         # Create PTY
         master_fd, slave_fd = pty.openpty()
         session.master_fd = master_fd
         
-        print(f"Created PTY for SSH: master={master_fd}, slave={slave_fd}")
+        logger.debug("Created PTY for SSH: master=%s, slave=%s", master_fd, slave_fd)
         
         # Make master non-blocking
-        flags = fcntl.fcntl(master_fd, fcntl.F_GETFL)
-        fcntl.fcntl(master_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        os.set_blocking(master_fd, False)
         
         # Start SSH process
         try:
-            process = subprocess.Popen(
-                ssh_args,
+            process = await asyncio.create_subprocess_exec(
+                *ssh_args,
                 stdin=slave_fd,
                 stdout=slave_fd,
                 stderr=slave_fd,
-                preexec_fn=os.setsid,
-                env={**os.environ.copy(), "TERM": "xterm-256color"}
+                start_new_session=True,
+                env=PTY_ENV,
+                # A key held in a memfd is read by ssh through its inherited fd
+                pass_fds=(temp_key_file,) if isinstance(temp_key_file, int) else ()
             )
             session.process = process
             
-            print(f"Started SSH process: PID={process.pid}, Command: {' '.join(ssh_args)}")
+            logger.info(f"Started SSH process: PID={process.pid}")
             
-            # Check if process started successfully
-            import time
-            time.sleep(0.1)
-            if process.poll() is not None:
-                print(f"SSH process died immediately with code: {process.returncode}")
+            # Check if process started successfully (without stalling the event
+            # loop, and with it every other session, while we wait)
+            await asyncio.sleep(0.1)
+            if process.returncode is not None:
+                logger.warning(f"SSH process died immediately with code: {process.returncode}")
                 raise RuntimeError(f"SSH process failed with code {process.returncode}")
         except Exception as e:
-            print(f"Failed to start SSH process: {e}")
+            logger.error(f"Failed to start SSH process: {e}")
             raise
         
         # Close slave FD in parent
@@ -408,47 +584,37 @@ async def websocket_session_endpoint(websocket: WebSocket, session_id: str):
         # Start output reader task
         async def read_output():
             """Read output from SSH PTY and send to WebSocket"""
-            print("Starting SSH output reader task")
-            loop = asyncio.get_event_loop()
-            
-            while process and process.poll() is None:  # While process is running
-                try:
-                    # Check if data is available to read
-                    r, _, _ = select.select([master_fd], [], [], 0.01)
-                    if r:
-                        try:
-                            # Read available data
-                            output = os.read(master_fd, 4096)
-                            if output:
-                                # Send to WebSocket as text
-                                text_output = output.decode('utf-8', errors='replace')
-                                await websocket.send_text(text_output)
-                        except OSError as e:
-                            if e.errno == 5:  # Input/output error
-                                break
-                            print(f"Read OSError: {e}")
-                    
-                except Exception as e:
-                    print(f"Read error: {e}")
-                    break
-                    
-                await asyncio.sleep(0.01)
-            
-            print("SSH output reader task ended")
+            logger.debug("Starting SSH output reader task")
+            try:
+                await pump_pty_output(master_fd, websocket)
+            except Exception as e:
+                logger.warning(f"Read error: {e}")
+            logger.debug("SSH output reader task ended")
         
-        # Start the reader task
+        # Start the reader task, and the writer that feeds client input to the PTY
         session.read_task = asyncio.create_task(read_output())
+        input_queue = asyncio.Queue(maxsize=PTY_INPUT_QUEUE_SIZE)
+        session.write_task = asyncio.create_task(pump_pty_input(master_fd, input_queue))
         
         # Handle incoming messages
         while True:
             try:
-                message = await websocket.receive_text()
-                data = json.loads(message)
+                frame = await receive_frame(websocket)
+                if isinstance(frame, bytes):
+                    # Keystrokes and resizes come as tagged binary frames, no JSON
+                    tag = frame[0] if frame else None
+                    if tag == FRAME_INPUT:
+                        await input_queue.put(memoryview(frame)[1:])
+                    elif tag == FRAME_RESIZE:
+                        rows, cols = RESIZE_FRAME.unpack_from(frame, 1)
+                        resize_pty(session, rows, cols)
+                    continue
+                data = json_loads(frame)
                 
                 if data['type'] == 'input':
                     # Write input to PTY
                     input_data = data['data']
-                    os.write(master_fd, input_data.encode())
+                    await input_queue.put(input_data.encode())
                     
                 elif data['type'] == 'ping':
                     # Respond to heartbeat ping
@@ -458,40 +624,29 @@ async def websocket_session_endpoint(websocket: WebSocket, session_id: str):
                     # Resize PTY
                     cols = data.get('cols', 80)
                     rows = data.get('rows', 24)
-
-                    # Set terminal size
-                    winsize = struct.pack('HHHH', rows, cols, 0, 0)
-                    fcntl.ioctl(master_fd, termios.TIOCSWINSZ, winsize)
-                    
-                    # Send SIGWINCH to process
-                    if process and process.pid:
-                        try:
-                            os.kill(process.pid, signal.SIGWINCH)
-                        except ProcessLookupError:
-                            print(f"Process {process.pid} not found for SIGWINCH")
+                    resize_pty(session, rows, cols)
                         
             except WebSocketDisconnect:
-                print("SSH WebSocket disconnected")
+                logger.info("SSH WebSocket disconnected")
                 break
             except Exception as e:
-                print(f"SSH WebSocket error: {e}")
+                logger.warning(f"SSH WebSocket error: {e}")
                 break
     
     finally:
-        # Cleanup
-        if session.read_task:
-            session.read_task.cancel()
+        # Cleanup (wait for the reader and writer so they stop watching master_fd
+        # before it's closed)
+        for task in (session.read_task, session.write_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
         
         # Terminate process
         if process:
-            try:
-                process.terminate()
-                process.wait(timeout=1)
-            except:
-                try:
-                    process.kill()
-                except:
-                    pass
+            await stop_process(process)
         
         # Close file descriptors
         if master_fd is not None:
@@ -506,13 +661,14 @@ async def websocket_session_endpoint(websocket: WebSocket, session_id: str):
             except:
                 pass
         
-        # Clean up temporary key file
-        if temp_key_file:
+        # Clean up temporary key file (or close its memfd)
+        if temp_key_file is not None:
             cleanup_temp_files(temp_key_file)
         
-        # Remove session
-        sessions.pop(f"session_{session_id}", None)
-        print(f"SSH session cleaned up: {session_id}")
+        # Remove session, unless a reconnect has already registered its own
+        if sessions.get(f"session_{session_id}") is session:
+            del sessions[f"session_{session_id}"]
+        logger.info(f"SSH session cleaned up: {session_id}")
 
 
 @app.on_event("shutdown")
@@ -533,5 +689,7 @@ if __name__ == "__main__":
         app,
         host="0.0.0.0",
         port=port,
-        log_level="info"
+        log_level="info",
+        # PTY output is mostly tiny frames; zlib on each costs more than it saves
+        ws_per_message_deflate=False
     )
\ No newline at end of file
@@ -2,21 +2,66 @@
 SSH connection handler for webapp
 Manages SSH connections based on session IDs from the bot
 """
+import asyncio
 import os
+import re
 import tempfile
 import subprocess
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Password and key passphrase prompts, matched on the raw bytes ssh prints
+PROMPT_RE = re.compile(rb'(?i)(password:|passphrase)')
 
-def create_ssh_command(connection, credentials=None):
-    """Create SSH command from connection details"""
+
+def store_private_key(private_key):
+    """Put a private key where ssh -i can read it, returning (handle, path).
+    
+    On Linux the key goes in a memfd: it never reaches the disk and is freed
+    with the last descriptor, even if we crash. The handle is then that fd,
+    which must be in the ssh process's pass_fds. Elsewhere it's a 0600 temp
+    file object. Either way, release it with cleanup_temp_files.
+    """
+    if hasattr(os, 'memfd_create'):
+        try:
+            fd = os.memfd_create("ssh_key")
+        except OSError:
+            pass  # Kernel without memfd support
+        else:
+            try:
+                os.fchmod(fd, 0o600)  # ssh refuses keys others can read
+                os.write(fd, private_key.encode())
+            except OSError:
+                os.close(fd)
+                raise
+            return fd, f"/proc/self/fd/{fd}"
+    
+    # Create temporary key file
+    temp_key_file = tempfile.NamedTemporaryFile(mode='w', suffix='.pem', delete=False)
+    temp_key_file.write(private_key)
+    temp_key_file.close()
+    
+    # Set proper permissions
+    os.chmod(temp_key_file.name, 0o600)
+    return temp_key_file, temp_key_file.name
+
+
+def create_ssh_command(connection, credentials=None, pool=None, user_id=None):
+    """Create SSH command from connection details.
+    
+    With a pool, a session to a host this user already has a transport to opens
+    as a new channel on it, skipping the handshake and authentication.
+    """
+    if pool is not None:
+        keepalive = pool.ssh_options((user_id, connection.host, connection.port, connection.username))
+    else:
+        keepalive = ["-o", "ServerAliveInterval=60"]
     ssh_args = [
         "ssh",
         "-t",  # Force pseudo-terminal allocation for proper terminal support
         "-o", "StrictHostKeyChecking=accept-new",
-        "-o", "ServerAliveInterval=60",
+        *keepalive,
         "-o", "PreferredAuthentications=password,keyboard-interactive",
         "-o", "PubkeyAuthentication=no",
         "-p", str(connection.port),
@@ -28,70 +73,81 @@ def create_ssh_command(connection, credentials=None):
     
     # Handle SSH key authentication
     if connection.auth_type == 'key' and credentials and credentials.get('private_key'):
-        # Create temporary key file
-        temp_key_file = tempfile.NamedTemporaryFile(mode='w', suffix='.pem', delete=False)
-        temp_key_file.write(credentials['private_key'])
-        temp_key_file.close()
-        
-        # Set proper permissions
-        os.chmod(temp_key_file.name, 0o600)
+        temp_key_file, key_path = store_private_key(credentials['private_key'])
         
         # Add key file to SSH command
         ssh_args.insert(1, "-i")
-        ssh_args.insert(2, temp_key_file.name)
+        ssh_args.insert(2, key_path)
     
     return ssh_args, temp_key_file
 
 
-def handle_ssh_authentication(master_fd, connection, credentials):
-    """Handle SSH authentication prompts"""
-    import select
-    import time
-    
-    print(f"Starting authentication handler for {connection.username}@{connection.host}")
+async def _read_when_ready(master_fd, timeout):
+    """Wait up to timeout seconds for output on master_fd and read it (None if none came)"""
+    loop = asyncio.get_running_loop()
+    readable = loop.create_future()
+    loop.add_reader(master_fd, lambda: readable.done() or readable.set_result(None))
+    try:
+        await asyncio.wait_for(readable, timeout)
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        loop.remove_reader(master_fd)
+    try:
+        return os.read(master_fd, 4096)
+    except OSError:  # Spurious wakeup (EAGAIN), or ssh already exited (EIO)
+        return None
+
+
+async def handle_ssh_authentication(master_fd, connection, credentials):
+    """Handle SSH authentication prompts.
     
-    # Wait for initial output
-    time.sleep(0.5)
+    Waits on the event loop for the prompt rather than sleeping, so other
+    sessions keep running while this one connects.
+    """
+    logger.info(f"Starting authentication handler for {connection.username}@{connection.host}")
     
-    # Check for password/passphrase prompt
-    r, _, _ = select.select([master_fd], [], [], 5)
-    if r:
-        output = os.read(master_fd, 4096)
-        output_str = output.decode('utf-8', errors='replace')
-        print(f"SSH prompt received: {repr(output_str)}")
+    # Wait for the password/passphrase prompt
+    output = await _read_when_ready(master_fd, 5.5)
+    if output:
+        logger.debug("SSH prompt received: %r", output)
         
-        output_lower = output_str.lower()
+        match = PROMPT_RE.search(output)
+        prompt = match.group(1).lower() if match else None
         
-        if 'password:' in output_lower and connection.auth_type == 'password':
+        if prompt == b'password:' and connection.auth_type == 'password':
             if credentials and credentials.get('password'):
                 password = credentials['password'] + '\n'
-                print(f"Sending password for {connection.username}")
+                logger.info(f"Sending password for {connection.username}")
                 written = os.write(master_fd, password.encode())
-                print(f"Wrote {written} bytes for password")
+                logger.debug("Wrote %s bytes for password", written)
                 
-                # Wait a bit and check for response
-                time.sleep(0.5)
-                r, _, _ = select.select([master_fd], [], [], 2)
-                if r:
-                    response = os.read(master_fd, 4096)
-                    print(f"Post-auth response: {repr(response.decode('utf-8', errors='replace'))}")
+                # Check for a response
+                response = await _read_when_ready(master_fd, 2.5)
+                if response:
+                    logger.debug("Post-auth response: %r", response)
                 
                 return True
-        elif 'passphrase' in output_lower and connection.auth_type == 'key':
+        elif prompt == b'passphrase' and connection.auth_type == 'key':
             if credentials and credentials.get('key_passphrase'):
                 passphrase = credentials['key_passphrase'] + '\n'
                 os.write(master_fd, passphrase.encode())
                 return True
     else:
-        print("No prompt received within timeout")
+        logger.warning("No prompt received within timeout")
     
     return False
 
 
 def cleanup_temp_files(*files):
-    """Clean up temporary files"""
+    """Clean up temporary files (and key memfds)"""
     for file_obj in files:
-        if file_obj and hasattr(file_obj, 'name'):
+        if isinstance(file_obj, int):
+            try:
+                os.close(file_obj)
+            except OSError:
+                pass
+        elif file_obj and hasattr(file_obj, 'name'):
             try:
                 os.unlink(file_obj.name)
             except:
@@ -14,6 +14,7 @@ class ReconnectingWebSocket {
         this.timeoutInterval = options.timeoutInterval || 2000; // Connection timeout
         this.maxReconnectAttempts = options.maxReconnectAttempts || null; // null = infinite
         this.automaticOpen = options.automaticOpen !== false; // Auto connect on instantiation
+        this.binaryType = options.binaryType || 'blob'; // How binary frames are delivered
 
         // State
         this.reconnectAttempts = 0;
@@ -46,6 +47,7 @@ class ReconnectingWebSocket {
 
         try {
             this.ws = new WebSocket(this.url, this.protocols);
+            this.ws.binaryType = this.binaryType;
         } catch (e) {
             console.error('WebSocket creation error:', e);
             this.scheduleReconnect();